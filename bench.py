@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# Benchmarks for the overhead of the KaaS platform, separate from kernel time.
+# Everything runs on the CPU, the GPU matmul backend is only measured if a GPU is available.
+#
+# ./bench.py run                      runs all benchmarks and writes results-bench/<commit>.json
+# ./bench.py compare old.json new.json flags benchmarks that got slower between two runs
+
+import argparse
+import datetime
+import importlib
+import json
+import multiprocessing as mp
+import os
+import pickle
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+
+import placement
+
+server = importlib.import_module("gpu-server-scaling")
+
+NOOP_FUNCTION = "noop-fn"
+
+BenchResult = typing.Dict[str, typing.Any]
+
+
+def _summarize(samples: typing.List[float]) -> BenchResult:
+    # samples are in seconds, results in microseconds
+    samples = sorted(samples)
+    n = len(samples)
+
+    return {
+        "samples": n,
+        "median_us": round(samples[n // 2] * 1e6, 3),
+        "p99_us": round(samples[min(n - 1, int(n * 0.99))] * 1e6, 3),
+        "mean_us": round(sum(samples) / n * 1e6, 3),
+        "min_us": round(samples[0] * 1e6, 3),
+    }
+
+
+def _measure(
+    fn: typing.Callable[[], typing.Any], repeat: int, warmup: int = 3
+) -> BenchResult:
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+
+    return _summarize(samples)
+
+
+def bench_scheduler(repeat: int) -> typing.Dict[str, BenchResult]:
+    # one acquire (place) and release on a cluster with 8 booted GPUs that are half full
+    results = {}
+
+    for name in placement.POLICIES:
+        policy = placement.make_policy(name)
+        state = placement.ClusterState(8, 4)
+        for gpu in range(8):
+            state.add_gpu()
+            state.acquire(gpu, 0)
+            state.acquire(gpu, 1)
+
+        def _acquire_release() -> None:
+            decision = policy.place(state)
+            policy.release(state, decision.gpu, decision.slot, 0.0)
+
+        results[f"scheduler/{name}"] = _measure(_acquire_release, repeat)
+
+    return results
+
+
+def bench_pipe_dispatch(repeat: int) -> typing.Dict[str, BenchResult]:
+    # round trip of a request through a worker pipe to the no-op function
+    recver, sender = mp.Pipe()
+    heartbeat = mp.Value("d", 0.0, lock=False)
+
+    p = mp.Process(
+        target=server._recv_function,
+        args=([recver], NOOP_FUNCTION, 0, [heartbeat]),
+    )
+    p.start()
+    recver.close()
+
+    msg = pickle.dumps({"shm": "", "shape": (0, 0), "dtype": "float32"})
+
+    def _dispatch() -> None:
+        sender.send(msg)
+        sender.recv()
+
+    result = _measure(_dispatch, repeat)
+
+    p.kill()
+    p.join()
+    sender.close()
+
+    return {"pipe_dispatch": result}
+
+
+def bench_client_setup(
+    repeat: int, sizes: typing.List[int]
+) -> typing.Dict[str, BenchResult]:
+    # shared memory setup in prepare(): create the shared segment, load the input
+    client = importlib.import_module("cuda-matmul-client")
+    import numpy as np
+
+    results = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for dtype in ("float32", "float64"):
+            for N in sizes:
+                npy_file = os.path.join(tmp, f"bench-{N}-{dtype}.npy")
+                arr = np.random.default_rng(0).random((N, N)).astype(dtype)
+                np.save(npy_file, arr)
+
+                client.NPY_FILE = npy_file
+                client.DTYPE = dtype
+
+                def _setup() -> None:
+                    shm = client._load_input(N)
+                    shm.close()
+                    shm.unlink()
+
+                results[f"client_setup/{dtype}/N={N}"] = _measure(_setup, repeat)
+
+    return results
+
+
+def _roundtrip(port: int, msg: bytes) -> None:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
+        client.connect(("localhost", port))
+        client.sendall(msg)
+        client.recv(8)
+
+
+def bench_server_roundtrip(
+    duration: float, concurrency: typing.List[int], port: int, worker_mode: str
+) -> typing.Dict[str, BenchResult]:
+    # full request round trip through the server to the no-op function
+    # with several clients sending requests back to back
+    if os.path.exists("/tmp/server-ready.nil"):
+        os.remove("/tmp/server-ready.nil")
+
+    # leave room for slots that are released only after the response is sent
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(
+                os.path.dirname(os.path.abspath(__file__)), "gpu-server-scaling.py"
+            ),
+            NOOP_FUNCTION,
+            "--port",
+            str(port),
+            "--num-gpus",
+            "2",
+            "--max-req-per-gpu",
+            str(max(concurrency)),
+            "--worker-mode",
+            worker_mode,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    results = {}
+
+    try:
+        while not os.path.exists("/tmp/server-ready.nil"):
+            if proc.poll() is not None:
+                raise RuntimeError("server exited before it became ready")
+            time.sleep(0.1)
+
+        msg = pickle.dumps({"shm": "", "shape": (0, 0), "dtype": "float32"})
+
+        # boot the workers before we measure anything
+        _roundtrip(port, msg)
+        time.sleep(1)
+
+        for c in concurrency:
+            samples: typing.List[float] = []
+            samples_lock = threading.Lock()
+            end = time.perf_counter() + duration
+
+            def _client() -> None:
+                local = []
+                while time.perf_counter() < end:
+                    start = time.perf_counter()
+                    _roundtrip(port, msg)
+                    local.append(time.perf_counter() - start)
+                with samples_lock:
+                    samples.extend(local)
+
+            threads = [threading.Thread(target=_client) for _ in range(c)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            result = _summarize(samples)
+            result["throughput_rps"] = round(len(samples) / duration, 1)
+            results[f"server_roundtrip/{worker_mode}/c={c}"] = result
+
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    return results
+
+
+def bench_matmul(repeat: int, sizes: typing.List[int]) -> typing.Dict[str, BenchResult]:
+    # inner time of each matmul backend, called directly
+    import numpy as np
+    from numba import cuda
+
+    backends = {"cpu": "cuda-matmul-cpu"}
+    if cuda.is_available():
+        backends["gpu"] = "cuda-matmul-fn"
+    else:
+        print("No GPU available, skipping the GPU matmul backend", file=sys.stderr)
+
+    results = {}
+
+    for backend, module in backends.items():
+        fn = importlib.import_module(module)
+
+        for dtype in fn.DTYPES:
+            for N in sizes:
+                mat_h = np.random.default_rng(0).random((N, N)).astype(dtype)
+
+                samples = [fn.square_gpu(mat_h, N) for _ in range(repeat)]
+                results[f"matmul/{backend}/{dtype}/N={N}"] = _summarize(samples)
+
+    return results
+
+
+def _commit() -> str:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:
+        return "unknown"
+
+
+def run(args: argparse.Namespace) -> None:
+    scale = 0.1 if args.quick else 1.0
+    repeat = max(5, int(args.repeat * scale))
+
+    results: typing.Dict[str, BenchResult] = {}
+
+    print("Benchmarking scheduler...")
+    results.update(bench_scheduler(repeat * 100))
+
+    print("Benchmarking pipe dispatch...")
+    results.update(bench_pipe_dispatch(repeat * 10))
+
+    print("Benchmarking client setup...")
+    results.update(bench_client_setup(repeat, [500, 2000]))
+
+    for worker_mode in (server.PROCESS_MODE, server.THREAD_MODE):
+        print(f"Benchmarking server round trip ({worker_mode} workers)...")
+        results.update(
+            bench_server_roundtrip(
+                args.duration * scale, [1, 2, 4, 8], args.port, worker_mode
+            )
+        )
+
+    print("Benchmarking matmul backends...")
+    results.update(bench_matmul(max(3, repeat // 10), [64, 128, 256]))
+
+    commit = _commit()
+    output = args.output
+    if output is None:
+        os.makedirs("results-bench", exist_ok=True)
+        output = f"results-bench/{commit}.json"
+
+    with open(output, "w") as f:
+        json.dump(
+            {
+                "commit": commit,
+                "timestamp": str(datetime.datetime.now(datetime.timezone.utc)),
+                "machine": os.uname().nodename,
+                "python": sys.version.split()[0],
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+    for name, result in results.items():
+        print(f"{name}: {result['median_us']}us (p99 {result['p99_us']}us)")
+
+    print(f"Results written to {output}")
+
+
+def compare(args: argparse.Namespace) -> None:
+    with open(args.baseline, "r") as f:
+        baseline = json.load(f)
+    with open(args.current, "r") as f:
+        current = json.load(f)
+
+    print(f"Comparing {current['commit']} against {baseline['commit']}")
+
+    regressions = 0
+
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"  new         {name}: {result['median_us']}us")
+            continue
+
+        old = baseline["results"][name]["median_us"]
+        new = result["median_us"]
+        change = (new - old) / old if old > 0 else 0.0
+
+        status = "ok"
+        if change > args.threshold:
+            status = "REGRESSION"
+            regressions += 1
+        elif change < -args.threshold:
+            status = "improved"
+
+        print(f"  {status:<11} {name}: {old}us -> {new}us ({change:+.1%})")
+
+    print(f"{regressions} regressions above {args.threshold:.0%}")
+
+    if regressions > 0:
+        exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KaaS Platform Overhead Benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run all benchmarks")
+    run_parser.add_argument(
+        "--output",
+        type=str,
+        default=None,
+        help="file to write results to (default: results-bench/<commit>.json)",
+    )
+    run_parser.add_argument(
+        "--repeat",
+        type=int,
+        default=100,
+        help="base number of repetitions per benchmark",
+    )
+    run_parser.add_argument(
+        "--duration",
+        type=float,
+        default=5.0,
+        help="seconds to run each server round trip concurrency level for",
+    )
+    run_parser.add_argument(
+        "--port",
+        type=int,
+        default=8090,
+        help="port to start the benchmark server on",
+    )
+    run_parser.add_argument(
+        "--quick",
+        action="store_true",
+        help="run fewer repetitions, for a quick sanity check",
+    )
+
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two benchmark results and flag regressions"
+    )
+    compare_parser.add_argument("baseline", type=str, help="results of the old commit")
+    compare_parser.add_argument("current", type=str, help="results of the new commit")
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown of the median above which a benchmark is flagged",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+    else:
+        compare(args)
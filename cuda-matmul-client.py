@@ -1,10 +1,18 @@
 #!/usr/bin/env python3
 # Square a random matrix of a given size on the CPU (multi-threaded using numpy)
 # The size of the matrix is given as the first argument.
+# Use N:tile_rows (e.g., 10000:1000) to stream the matrix in row tiles instead.
 
-from multiprocessing import shared_memory
+from multiprocessing import resource_tracker, shared_memory
+import _posixshmem  # type: ignore
+import contextlib
+import fcntl
+import hashlib
+import math
 import os
 import pickle
+import secrets
+import select
 import socket
 import struct
 import sys
@@ -15,30 +23,166 @@ import numpy as np
 
 NPY_FILE = ""
 
+# non-streamed requests all send the same read-only segment holding the input
+INPUT_SHM: typing.Optional[shared_memory.SharedMemory] = None
+
+# streamed requests mark the state of each row tile in a control segment
+TILE_STAGED = 1
+TILE_DONE = 2
+POLL_INTERVAL = 0.0005
+
+# the server answers this message with the dtypes the function supports
+DESCRIBE = b"kaas:describe"
+
+# dtypes we can send, in order of preference (narrowest first)
+DTYPES = ("float16", "float32", "float64")
+DTYPE = "float64"
+
+# rows of the input generated at a time, so that generating it needs little memory
+GENERATE_ROWS = 1000
+
+
+def _negotiate_dtype() -> str:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
+        client.connect(("localhost", 8081))
+        client.sendall(DESCRIBE)
+        supported = pickle.loads(client.recv(1024))
+
+    for dtype in DTYPES:
+        if dtype in supported:
+            return dtype
+
+    raise RuntimeError(f"function supports none of our dtypes {DTYPES}: {supported}")
+
+
+def _parse_input(arg: typing.Any) -> typing.Tuple[int, int]:
+    # the input is either N or N:tile_rows, tile_rows is 0 if we do not stream
+    N, _, tile_rows = str(arg).partition(":")
+    return int(N), int(tile_rows) if tile_rows else 0
+
+
+@contextlib.contextmanager
+def _store_lock(npy_file: str) -> typing.Iterator[None]:
+    # all copies of the client (in different processes) share the input store,
+    # so we lock the directory it is in while changing it
+    fd = os.open(os.path.dirname(os.path.abspath(npy_file)), os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _add_ref(npy_file: str, delta: int) -> int:
+    # counts the copies using an input, call this only while holding the store lock
+    refs_file = f"{npy_file}.refs"
+
+    refs = 0
+    if os.path.exists(refs_file):
+        with open(refs_file, "r") as f:
+            refs = int(f.read())
+
+    refs += delta
+
+    if refs > 0:
+        with open(refs_file, "w") as f:
+            f.write(str(refs))
+    elif os.path.exists(refs_file):
+        os.remove(refs_file)
+
+    return refs
+
+
+def _generate_input(npy_file: str, N: int) -> None:
+    # create a random array, in blocks of rows straight into the file
+    # it is converted to the negotiated dtype here once, not for every request
+    tmp_file = f"{npy_file}.{os.getpid()}.tmp"
+
+    rng = np.random.default_rng(0)
+    arr = np.lib.format.open_memmap(tmp_file, mode="w+", dtype=DTYPE, shape=(N, N))
+
+    for r0 in range(0, N, GENERATE_ROWS):
+        r1 = min(N, r0 + GENERATE_ROWS)
+        arr[r0:r1] = rng.random((r1 - r0, N), dtype=np.float64)
+
+    arr.flush()
+    del arr
+
+    os.replace(tmp_file, npy_file)
+
+
+def _input_shm_name(npy_file: str) -> str:
+    # every copy using the same input file derives the same segment name
+    digest = hashlib.sha1(os.path.abspath(npy_file).encode()).hexdigest()[:12]
+    return f"kaas-input-{digest}"
+
+
+def _open_input_shm(npy_file: str, N: int) -> shared_memory.SharedMemory:
+    # attach to the shared input segment, creating it if we are the first copy
+    # call this only while holding the store lock
+    name = _input_shm_name(npy_file)
+
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        shm = _load_input(N, name)
+
+    # the segment outlives this process while other copies use it, the store's
+    # reference count decides when it is unlinked, not the resource tracker
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+
+    return shm
+
 
 def prepare(N: int, copy: int = 0) -> None:
     global NPY_FILE
+    global DTYPE
+    global INPUT_SHM
 
-    N = int(N)
-    copy_s = str(copy)
-
-    NPY_FILE = f"test-{N}-{copy_s}.npy"
+    N, tile_rows = _parse_input(N)
 
     try:
-        # create a random array
-        rng = np.random.default_rng(0)
-        arr = rng.random((N, N), dtype=np.float64)
+        DTYPE = _negotiate_dtype()
+
+        # all copies send the same input, so it is generated only once and
+        # every copy maps the same file (and the same segment) read-only
+        NPY_FILE = f"test-{N}-{DTYPE}.npy"
 
-        # save it to a file
-        np.save(NPY_FILE, arr)
+        with _store_lock(NPY_FILE):
+            if not os.path.exists(NPY_FILE):
+                _generate_input(NPY_FILE, N)
+
+            # streamed requests stage their tiles straight from the file, so
+            # their input never has to fit into one segment
+            if tile_rows == 0:
+                INPUT_SHM = _open_input_shm(NPY_FILE, N)
+            _add_ref(NPY_FILE, 1)
     except Exception as e:
         print("Error preparing matrix: ", e)
         raise e
 
 
 def cleanup() -> None:
+    global INPUT_SHM
+
     try:
-        os.remove(NPY_FILE)
+        # the last copy using the input removes it
+        with _store_lock(NPY_FILE):
+            last = _add_ref(NPY_FILE, -1) == 0
+
+            if INPUT_SHM is not None:
+                INPUT_SHM.close()
+                INPUT_SHM = None
+
+            if last:
+                # another (non-streamed) copy may have created the segment,
+                # it is not tracked since prepare(), so we unlink it directly
+                try:
+                    _posixshmem.shm_unlink(f"/{_input_shm_name(NPY_FILE)}")
+                except FileNotFoundError:
+                    pass
+
+                os.remove(NPY_FILE)
     except Exception as e:
         print("Error cleaning up matrix file: ", e)
         raise e
@@ -50,33 +194,120 @@ def run_client(N: int) -> typing.Tuple[float, float, float, bool]:
     if NPY_FILE == "":
         raise RuntimeError("Matrix file not prepared")
 
+    N, tile_rows = _parse_input(N)
+
+    if tile_rows > 0:
+        return _run_client_streamed(N, tile_rows)
+
+    if INPUT_SHM is None:
+        raise RuntimeError("Shared input not prepared")
+
     outer_start = time.perf_counter()
 
-    N = int(N)
+    # the function only reads the input, so we send the segment shared by all
+    # copies instead of loading the input for every request
+    msg = pickle.dumps({"shm": INPUT_SHM.name, "shape": (N, N), "dtype": DTYPE})
+
+    setup_time = time.perf_counter() - outer_start
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
+        client.connect(("localhost", 8081))
+        # client.sendall(struct.pack("i", N))
+        client.sendall(msg)
+        inner_time_p = client.recv(8)
+
+    cold_start, inner_time = struct.unpack("?f", inner_time_p)
+
+    outer_time = time.perf_counter() - outer_start
+
+    return (
+        round(outer_time * 1000, 3),
+        round(float(inner_time) * 1000, 3),
+        round(setup_time * 1000, 3),
+        cold_start,
+    )
+
 
+def _load_input(
+    N: int, name: typing.Optional[str] = None
+) -> shared_memory.SharedMemory:
     # following https://gist.github.com/lsena/a34c08dc385644165c99c12f793154a6#file-numpy_shared_memory-py
     # create a shared memory region
-    d_size = int(np.dtype(np.float64).itemsize * np.prod((N, N)))
-    shm = shared_memory.SharedMemory(create=True, size=d_size)
+    d_size = int(np.dtype(DTYPE).itemsize * np.prod((N, N)))
+    shm = shared_memory.SharedMemory(name=name, create=True, size=d_size)
 
     # create a random numpy array on that region
-    dst = np.ndarray(shape=(N, N), dtype=np.float64, buffer=shm.buf)  # type: ignore
+    dst = np.ndarray(shape=(N, N), dtype=DTYPE, buffer=shm.buf)  # type: ignore
 
     # read it from the file into the shared memory
     dst[:] = np.load(NPY_FILE, mmap_mode="r")
 
+    return shm
+
+
+def _run_client_streamed(
+    N: int, tile_rows: int
+) -> typing.Tuple[float, float, float, bool]:
+    outer_start = time.perf_counter()
+
+    ntiles = math.ceil(N / tile_rows)
+
+    # tiles get their own segments, so the input does not have to fit into one
+    name = f"kaas-{os.getpid()}-{secrets.token_hex(4)}"
+    ctrl = shared_memory.SharedMemory(name=f"{name}-ctrl", create=True, size=ntiles)
+    ctrl.buf[:ntiles] = bytes(ntiles)
+
+    src = np.load(NPY_FILE, mmap_mode="r")
+
     setup_time = time.perf_counter() - outer_start
 
+    shms = []
+
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client:
         client.connect(("localhost", 8081))
-        # client.sendall(struct.pack("i", N))
-        client.sendall(pickle.dumps((shm.name, N)))
+        client.sendall(
+            pickle.dumps(
+                {"shm": name, "shape": (N, N), "dtype": DTYPE, "tile_rows": tile_rows}
+            )
+        )
+
+        # stage the tiles while the function is already working on the first ones
+        for i in range(ntiles):
+            r0 = i * tile_rows
+            r1 = min(N, r0 + tile_rows)
+
+            d_size = int(np.dtype(DTYPE).itemsize * (r1 - r0) * N)
+            shm = shared_memory.SharedMemory(name=f"{name}-{i}", create=True, size=d_size)
+            dst = np.ndarray(shape=(r1 - r0, N), dtype=DTYPE, buffer=shm.buf)  # type: ignore
+            dst[:] = src[r0:r1]
+
+            ctrl.buf[i] = TILE_STAGED
+            shms.append(shm)
+
+        # result tiles come back one by one, we are done with a tile (and its
+        # memory can be freed) as soon as the function marks it
+        # stop early if the function answers without finishing all tiles
+        done = 0
+        while done < ntiles:
+            if ctrl.buf[done] == TILE_DONE:
+                shms[done].close()
+                shms[done].unlink()
+                done += 1
+                continue
+
+            readable, _, _ = select.select([client], [], [], POLL_INTERVAL)
+            if readable:
+                break
+
         inner_time_p = client.recv(8)
 
     cold_start, inner_time = struct.unpack("?f", inner_time_p)
 
-    shm.close()
-    shm.unlink()
+    for shm in shms[done:]:
+        shm.close()
+        shm.unlink()
+    ctrl.close()
+    ctrl.unlink()
 
     outer_time = time.perf_counter() - outer_start
 
@@ -91,12 +322,13 @@ def run_client(N: int) -> typing.Tuple[float, float, float, bool]:
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         try:
-            N = int(input("Enter dimension: "))
+            N = input("Enter dimension: ")
+            _parse_input(N)
         except Exception as ex:
             print("Required argument in stdin: dimension of matrix (int)")
             exit(-1)
     else:
-        N = int(sys.argv[1])
+        N = sys.argv[1]
 
     prepare(N)
 
@@ -104,6 +336,9 @@ if __name__ == "__main__":
 
     cleanup()
 
+    dim, _ = _parse_input(N)
+    input_mb = dim * dim * np.dtype(DTYPE).itemsize / 1e6
+    print(f"Input: {dim}x{dim} {DTYPE} ({input_mb} MB)")
     print(f"Elapsed outer time (ms): {outer_time}")
     print(f"Setup time (ms): {setup_time}")
     print("")
@@ -3,10 +3,14 @@
 # The fast matrix-multiply code is adapted from: https://numba.readthedocs.io/en/stable/cuda/examples.html#id30
 
 import os
+import math
 import time
+import queue
 import struct
 import pickle
-from multiprocessing import shared_memory
+import threading
+import typing
+from multiprocessing import resource_tracker, shared_memory
 import numpy as np
 import numba
 
@@ -22,8 +26,26 @@ import warnings
 
 warnings.simplefilter("ignore", category=UserWarning)
 
+# streamed requests mark the state of each row tile in a control segment
+TILE_STAGED = 1
+TILE_DONE = 2
+POLL_INTERVAL = 0.0005
 
-@numba.jit(nopython=True)
+# seconds we wait for the client to stage a tile before we give up on it
+TILE_TIMEOUT = 30.0
+
+# compiling for streamed requests adds to the cold start of every worker, so
+# this is only done at import if asked for, and otherwise by the first
+# streamed request
+WARMUP_STREAMED = os.environ.get("WARMUP_STREAMED", "0") == "1"
+
+# input dtypes this function supports, in order of preference
+# clients send their matrices in the first of these they can produce
+DTYPES = ("float32", "float64")
+
+
+# nogil lets several requests in the same worker process compute in parallel
+@numba.jit(nopython=True, nogil=True)
 def matmul(A, B, C):  # type: ignore
     """Perform square matrix multiplication of C = A * B"""
 
@@ -35,12 +57,24 @@ def matmul(A, B, C):  # type: ignore
             C[i, j] = tmp
 
 
+@numba.jit(nopython=True, nogil=True)
+def matmul_acc(A, B, C):  # type: ignore
+    """Accumulate the product of two matrix blocks C += A * B"""
+
+    for i in range(C.shape[0]):
+        for j in range(C.shape[1]):
+            tmp = 0.0
+            for k in range(A.shape[1]):
+                tmp += A[i, k] * B[k, j]
+            C[i, j] += tmp
+
+
 ################
 # Create a random square matrix and multiply it by itself on CPU.
 # for reproducibility, we set a fixed seed for the rng
 def square_gpu(mat_h: np.ndarray, N: int) -> float:  # type: ignore
     # mat_h = np.random.default_rng(0).random((N, N))
-    sq_h = np.zeros([N, N])
+    sq_h = np.zeros([N, N], dtype=mat_h.dtype)
 
     start = time.perf_counter()
 
@@ -51,12 +85,120 @@ def square_gpu(mat_h: np.ndarray, N: int) -> float:  # type: ignore
     return inner_time
 
 
+def _wait_for_tile(ctrl: shared_memory.SharedMemory, i: int) -> None:
+    # a client that goes away while staging never marks its remaining tiles
+    deadline = time.perf_counter() + TILE_TIMEOUT
+    while ctrl.buf[i] < TILE_STAGED:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"tile {i} was not staged within {TILE_TIMEOUT}s")
+        time.sleep(POLL_INTERVAL)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # the client owns its segments (the input may be shared by many requests),
+    # so the resource tracker must not unlink them when this worker exits
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+    return shm
+
+
+################
+# Square a matrix that arrives as row tiles in separate shared memory segments.
+# A producer thread maps the tiles as the client stages them, while we already
+# multiply every pair of blocks whose tiles are both available:
+# C_i += A_i[:, K_j] * A_j, where K_j are the columns matching the rows of tile j.
+# Every result tile is written back into the segment of its input tile as soon
+# as that input is no longer needed, and marked as done for the client.
+def square_gpu_streamed(name: str, N: int, tile_rows: int, dtype: np.dtype) -> float:
+    ntiles = math.ceil(N / tile_rows)
+    bounds = [(i * tile_rows, min(N, (i + 1) * tile_rows)) for i in range(ntiles)]
+
+    ctrl = _attach(f"{name}-ctrl")
+    staged: queue.Queue = queue.Queue()  # type: ignore
+
+    def _stage() -> None:
+        try:
+            for i, (r0, r1) in enumerate(bounds):
+                _wait_for_tile(ctrl, i)
+                shm = _attach(f"{name}-{i}")
+                tile = np.ndarray(
+                    (r1 - r0, N), dtype=dtype, buffer=shm.buf  # type: ignore
+                )
+                staged.put((shm, tile))
+        except Exception as e:
+            # e.g., the client went away, the main thread raises this for us
+            staged.put(e)
+
+    shms = []
+    tiles = []
+    sq: typing.List[typing.Optional[np.ndarray]] = []  # type: ignore
+
+    def _finish(i: int) -> None:
+        tiles[i][:] = sq[i]
+        sq[i] = None
+        ctrl.buf[i] = TILE_DONE
+        shms[i].close()
+
+    start = time.perf_counter()
+
+    producer = threading.Thread(target=_stage)
+    producer.start()
+
+    for t in range(ntiles):
+        try:
+            item = staged.get(timeout=TILE_TIMEOUT)
+        except queue.Empty:
+            raise TimeoutError(f"tile {t} was not staged within {TILE_TIMEOUT}s")
+        if isinstance(item, Exception):
+            raise item
+
+        shm, tile = item
+        shms.append(shm)
+        tiles.append(tile)
+        sq.append(np.zeros(tile.shape, dtype=dtype))
+
+        # all block pairs (i, j) with max(i, j) == t just became available
+        # result tile t goes first, as it needs every input tile
+        for j in range(t + 1):
+            r0, r1 = bounds[j]
+            matmul_acc(tiles[t][:, r0:r1], tiles[j], sq[t])
+
+        r0, r1 = bounds[t]
+        for i in range(t):
+            matmul_acc(tiles[i][:, r0:r1], tiles[t], sq[i])
+
+            # once the last tile is in, this was the last product of result
+            # tile i, and its input is not needed anymore
+            if t == ntiles - 1:
+                _finish(i)
+
+    _finish(ntiles - 1)
+
+    producer.join()
+
+    inner_time = time.perf_counter() - start
+
+    ctrl.close()
+
+    return inner_time
+
+
 def call(p: bytes) -> bytes:
-    shm_name, N = pickle.loads(p)
-    # print(f"have received shm_name {shm_name} and N {N}")
+    request = pickle.loads(p)
+    N, _ = request["shape"]
+    dtype = np.dtype(request["dtype"])
+
+    if dtype.name not in DTYPES:
+        raise ValueError(f"unsupported dtype {dtype.name}, use one of {DTYPES}")
+
+    if request.get("tile_rows", 0) > 0:
+        inner_time = square_gpu_streamed(request["shm"], N, request["tile_rows"], dtype)
+        return struct.pack("f", inner_time)
+
+    # print(f"have received request {request}")
     # unpack shared memory
-    shm = shared_memory.SharedMemory(name=shm_name)
-    mat_h = np.ndarray((N, N), dtype=np.float64, buffer=shm.buf)  # type: ignore
+    shm = _attach(request["shm"])
+    mat_h = np.ndarray((N, N), dtype=dtype, buffer=shm.buf)  # type: ignore
     inner_time = square_gpu(mat_h, N)
     shm.close()
 
@@ -65,6 +207,18 @@ def call(p: bytes) -> bytes:
     return struct.pack("f", inner_time)
 
 
+# trigger numba jit for every supported dtype
+# streamed requests multiply column slices of tiles (or whole tiles if there
+# is only one), which numba compiles separately
+for __dtype in DTYPES:
+    __mat_h = np.ones((10, 10), dtype=__dtype)
+    square_gpu(__mat_h, 10)
+
+    if WARMUP_STREAMED:
+        matmul_acc(__mat_h[:, 0:5], __mat_h[0:5], np.zeros((10, 10), dtype=__dtype))
+        matmul_acc(__mat_h, __mat_h, np.zeros((10, 10), dtype=__dtype))
+
+
 if __name__ == "__main__":
     import sys
 
@@ -78,7 +232,7 @@ if __name__ == "__main__":
         N = int(sys.argv[1])
 
     rng = np.random.default_rng(0)
-    mat_h = rng.random((N, N), dtype=np.float64)
+    mat_h = rng.random((N, N), dtype=np.float64).astype(DTYPES[0])
 
     inner_time = square_gpu(mat_h, N)
 
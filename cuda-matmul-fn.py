@@ -7,60 +7,98 @@ import time
 import math
 import struct
 import pickle
-from multiprocessing import shared_memory
+import contextlib
+from multiprocessing import resource_tracker, shared_memory
 import numpy as np
-from numba import cuda, float32
+from numba import cuda, float32, float64
+
+DEVICE = int(os.environ.get("WORKER_GPU", 0))
 
 if "WORKER_GPU" in os.environ:
-    cuda.select_device(int(os.environ["WORKER_GPU"]))
+    cuda.select_device(DEVICE)
 
 # Controls threads per block and shared memory usage.
 # The computation will be done on blocks of TPBxTPB elements.
 # TPB should not be larger than 32 in this example
 TPB = 16
 
-
-@cuda.jit
-def device_matmul(A, B, C):  # type: ignore
-    """
-    Perform matrix multiplication of C = A * B using CUDA shared memory.
-
-    Reference: https://stackoverflow.com/a/64198479/13697228 by @RobertCrovella
-    """
-    # Define an array in the shared memory
-    # The size and type of the arrays must be known at compile time
-    sA = cuda.shared.array(shape=(TPB, TPB), dtype=float32)
-    sB = cuda.shared.array(shape=(TPB, TPB), dtype=float32)
-
-    x, y = cuda.grid(2)
-
-    tx = cuda.threadIdx.x
-    ty = cuda.threadIdx.y
-    bpg = cuda.gridDim.x  # blocks per grid
-
-    # Each thread computes one element in the result matrix.
-    # The dot product is chunked into dot products of TPB-long vectors.
-    tmp = float32(0.0)
-    for i in range(bpg):
-        # Preload data into shared memory
-        sA[ty, tx] = 0
-        sB[ty, tx] = 0
-        if y < A.shape[0] and (tx + i * TPB) < A.shape[1]:
-            sA[ty, tx] = A[y, tx + i * TPB]
-        if x < B.shape[1] and (ty + i * TPB) < B.shape[0]:
-            sB[ty, tx] = B[ty + i * TPB, x]
-
-        # Wait until all threads finish preloading
-        cuda.syncthreads()
-
-        # Computes partial product on the shared memory
-        for j in range(TPB):
-            tmp += sA[ty, j] * sB[j, tx]
-
-        # Wait until all threads finish computing
-        cuda.syncthreads()
-    if y < C.shape[0] and x < C.shape[1]:
-        C[y, x] = tmp
+# streamed requests mark the state of each row tile in a control segment
+TILE_STAGED = 1
+TILE_DONE = 2
+POLL_INTERVAL = 0.0005
+
+# seconds we wait for the client to stage a tile before we give up on it
+TILE_TIMEOUT = 30.0
+
+# compiling the kernels for streamed requests adds to the cold start of every
+# worker, so this is only done at import if asked for, and otherwise by the
+# first streamed request
+WARMUP_STREAMED = os.environ.get("WARMUP_STREAMED", "0") == "1"
+
+# input dtypes this function supports, in order of preference
+# clients send their matrices in the first of these they can produce
+DTYPES = ("float32", "float64")
+NUMBA_TYPES = {"float32": float32, "float64": float64}
+
+
+def _make_device_matmul(dtype: str, accumulate: bool = False):  # type: ignore
+    # the shared memory arrays need their type at compile time, so we build
+    # one kernel per supported dtype
+    # accumulating kernels add their product to C instead of overwriting it
+    nb_type = NUMBA_TYPES[dtype]
+
+    @cuda.jit
+    def device_matmul(A, B, C):  # type: ignore
+        """
+        Perform matrix multiplication of C = A * B using CUDA shared memory.
+
+        Reference: https://stackoverflow.com/a/64198479/13697228 by @RobertCrovella
+        """
+        # Define an array in the shared memory
+        # The size and type of the arrays must be known at compile time
+        sA = cuda.shared.array(shape=(TPB, TPB), dtype=nb_type)
+        sB = cuda.shared.array(shape=(TPB, TPB), dtype=nb_type)
+
+        x, y = cuda.grid(2)
+
+        tx = cuda.threadIdx.x
+        ty = cuda.threadIdx.y
+        # blocks along the inner dimension (the grid only spans C, which
+        # is not square for blocks of a streamed matrix)
+        bpg = (A.shape[1] + TPB - 1) // TPB
+
+        # Each thread computes one element in the result matrix.
+        # The dot product is chunked into dot products of TPB-long vectors.
+        tmp = nb_type(0.0)
+        for i in range(bpg):
+            # Preload data into shared memory
+            sA[ty, tx] = 0
+            sB[ty, tx] = 0
+            if y < A.shape[0] and (tx + i * TPB) < A.shape[1]:
+                sA[ty, tx] = A[y, tx + i * TPB]
+            if x < B.shape[1] and (ty + i * TPB) < B.shape[0]:
+                sB[ty, tx] = B[ty + i * TPB, x]
+
+            # Wait until all threads finish preloading
+            cuda.syncthreads()
+
+            # Computes partial product on the shared memory
+            for j in range(TPB):
+                tmp += sA[ty, j] * sB[j, tx]
+
+            # Wait until all threads finish computing
+            cuda.syncthreads()
+        if y < C.shape[0] and x < C.shape[1]:
+            if accumulate:
+                C[y, x] += tmp
+            else:
+                C[y, x] = tmp
+
+    return device_matmul
+
+
+KERNELS = {dtype: _make_device_matmul(dtype) for dtype in DTYPES}
+ACC_KERNELS = {dtype: _make_device_matmul(dtype, True) for dtype in DTYPES}
 
 
 ################
@@ -71,7 +109,7 @@ def square_gpu(mat_h: np.ndarray, N: int) -> float:  # type: ignore
     # N = int(n)
 
     # mat_h = np.random.default_rng(0).random((N, N))
-    sq_h = np.zeros([N, N])
+    sq_h = np.zeros([N, N], dtype=mat_h.dtype)
 
     cuda.pinned(mat_h)
     cuda.pinned(sq_h)
@@ -81,24 +119,152 @@ def square_gpu(mat_h: np.ndarray, N: int) -> float:  # type: ignore
     blockspergrid_y = math.ceil(sq_h.shape[1] / threadsperblock[1])
     blockspergrid = (blockspergrid_x, blockspergrid_y)
 
+    # every request gets its own stream, so that concurrent requests in the
+    # same process do not serialize on the default stream
+    stream = cuda.stream()
+
     start = time.perf_counter()
 
-    mat_d = cuda.to_device(mat_h)
-    sq_d = cuda.to_device(sq_h)
-    device_matmul[blockspergrid, threadsperblock](mat_d, mat_d, sq_d)
-    sq_h = sq_d.copy_to_host()
+    mat_d = cuda.to_device(mat_h, stream=stream)
+    sq_d = cuda.to_device(sq_h, stream=stream)
+    KERNELS[mat_h.dtype.name][blockspergrid, threadsperblock, stream](
+        mat_d, mat_d, sq_d
+    )
+    sq_h = sq_d.copy_to_host(stream=stream)
+    stream.synchronize()
 
     inner_time = time.perf_counter() - start
 
     return inner_time
 
 
+def _wait_for_tile(ctrl: shared_memory.SharedMemory, i: int) -> None:
+    # a client that goes away while staging never marks its remaining tiles
+    deadline = time.perf_counter() + TILE_TIMEOUT
+    while ctrl.buf[i] < TILE_STAGED:
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"tile {i} was not staged within {TILE_TIMEOUT}s")
+        time.sleep(POLL_INTERVAL)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # the client owns its segments (the input may be shared by many requests),
+    # so the resource tracker must not unlink them when this worker exits
+    shm = shared_memory.SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+    return shm
+
+
+################
+# Streaming wrapper for device_matmul()
+# The input arrives as row tiles in separate shared memory segments that the
+# client stages one after the other. Each tile is copied to the GPU on its own
+# stream as soon as it is staged, and we multiply every pair of blocks whose
+# tiles are both on the GPU while later tiles are still being staged:
+# C_i += A_i[:, K_j] * A_j, where K_j are the columns matching the rows of tile j.
+# Every result tile is copied back into the segment of its input tile as soon
+# as its last product is done, and marked as done for the client.
+def square_gpu_streamed(name: str, N: int, tile_rows: int, dtype: np.dtype) -> float:
+    ntiles = math.ceil(N / tile_rows)
+    bounds = [(i * tile_rows, min(N, (i + 1) * tile_rows)) for i in range(ntiles)]
+
+    ctrl = _attach(f"{name}-ctrl")
+    shms = []
+    tiles = []
+
+    # uploads run on their own streams, all kernels run on one compute stream
+    # so that the updates of a result tile do not race each other
+    copy_streams = [cuda.stream() for _ in range(ntiles)]
+    compute = cuda.stream()
+
+    tiles_d = []
+    sq_d = []
+
+    threadsperblock = (TPB, TPB)
+
+    start = time.perf_counter()
+
+    # tiles are unpinned one by one once their result is back
+    pins = []
+
+    with contextlib.ExitStack() as pinned:
+        for t, (r0, r1) in enumerate(bounds):
+            _wait_for_tile(ctrl, t)
+
+            shm = _attach(f"{name}-{t}")
+            tile = np.ndarray((r1 - r0, N), dtype=dtype, buffer=shm.buf)  # type: ignore
+            pin = pinned.enter_context(contextlib.ExitStack())
+            pin.enter_context(cuda.pinned(tile))
+            pins.append(pin)
+
+            tiles_d.append(cuda.to_device(tile, stream=copy_streams[t]))
+            sq_d.append(cuda.device_array((r1 - r0, N), dtype=dtype, stream=compute))
+
+            uploaded = cuda.event()
+            uploaded.record(copy_streams[t])
+            uploaded.wait(compute)
+
+            shms.append(shm)
+            tiles.append(tile)
+
+            # all block pairs (i, j) with max(i, j) == t just became available
+            # the first product of a result tile initializes it
+            for i in range(t + 1):
+                for j in range(t + 1) if i == t else [t]:
+                    j0, j1 = bounds[j]
+                    device_matmul = (ACC_KERNELS if j > 0 else KERNELS)[dtype.name]
+                    blockspergrid = (
+                        math.ceil(N / TPB),
+                        math.ceil(tiles_d[i].shape[0] / TPB),
+                    )
+                    device_matmul[blockspergrid, threadsperblock, compute](
+                        tiles_d[i][:, j0:j1], tiles_d[j], sq_d[i]
+                    )
+
+                    # this was the last product of result tile i, its input
+                    # is already on the GPU so we can copy the result over it
+                    if t == ntiles - 1 and j == t:
+                        finished = cuda.event()
+                        finished.record(compute)
+                        finished.wait(copy_streams[i])
+                        sq_d[i].copy_to_host(tiles[i], stream=copy_streams[i])
+
+        # only wait for our own streams, other requests may share the GPU
+        for i in range(ntiles):
+            copy_streams[i].synchronize()
+            pins[i].close()
+            ctrl.buf[i] = TILE_DONE
+            shms[i].close()
+
+    inner_time = time.perf_counter() - start
+
+    ctrl.close()
+
+    return inner_time
+
+
 def call(p: bytes) -> bytes:
-    shm_name, N = pickle.loads(p)
-    # print(f"have received shm_name {shm_name} and N {N}")
+    # a worker may call us from several threads, each needs the context of our GPU
+    with cuda.gpus[DEVICE]:
+        return _call(p)
+
+
+def _call(p: bytes) -> bytes:
+    request = pickle.loads(p)
+    N, _ = request["shape"]
+    dtype = np.dtype(request["dtype"])
+
+    if dtype.name not in DTYPES:
+        raise ValueError(f"unsupported dtype {dtype.name}, use one of {DTYPES}")
+
+    if request.get("tile_rows", 0) > 0:
+        inner_time = square_gpu_streamed(request["shm"], N, request["tile_rows"], dtype)
+        return struct.pack("f", inner_time)
+
+    # print(f"have received request {request}")
     # unpack shared memory
-    shm = shared_memory.SharedMemory(name=shm_name)
-    mat_h = np.ndarray((N, N), dtype=np.float64, buffer=shm.buf)  # type: ignore
+    shm = _attach(request["shm"])
+    mat_h = np.ndarray((N, N), dtype=dtype, buffer=shm.buf)  # type: ignore
     inner_time = square_gpu(mat_h, N)
     shm.close()
 
@@ -106,10 +272,21 @@ def call(p: bytes) -> bytes:
 
 
 # start a new context on init
-# and trigger numba jit
+# and trigger numba jit for every supported dtype
+# streamed requests call the kernels on column slices of tiles (or whole
+# tiles if there is only one), which numba compiles separately
 __rng = np.random.default_rng(0)
-__mat_h = __rng.random((10, 10), dtype=np.float64)
-square_gpu(__mat_h, 10)
+for __dtype in DTYPES:
+    __mat_h = __rng.random((10, 10)).astype(__dtype)
+    square_gpu(__mat_h, 10)
+
+    if WARMUP_STREAMED:
+        __mat_d = cuda.to_device(__mat_h)
+        __sq_d = cuda.device_array((10, 10), dtype=__dtype)
+        for __kernel in (KERNELS[__dtype], ACC_KERNELS[__dtype]):
+            __kernel[(1, 1), (TPB, TPB)](__mat_d[:, 0:5], __mat_d[0:5], __sq_d)
+            __kernel[(1, 1), (TPB, TPB)](__mat_d, __mat_d, __sq_d)
+cuda.synchronize()
 
 
 if __name__ == "__main__":
@@ -125,7 +302,7 @@ if __name__ == "__main__":
         N = int(sys.argv[1])
 
     rng = np.random.default_rng(0)
-    mat_h = rng.random((N, N), dtype=np.float64)
+    mat_h = rng.random((N, N), dtype=np.float64).astype(DTYPES[0])
 
     inner_time = square_gpu(mat_h, N)
 
@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
+import bisect
 import os
 import time
 import importlib
 import multiprocessing as mp
 from multiprocessing.connection import Connection as MultiprocessingConnection
+import pickle
+import socket
 import socketserver
 import signal
 import struct
@@ -14,9 +17,96 @@ import threading
 import typing
 import warnings
 
+import placement
+
+# outcomes of waiting for a worker to answer a request
+DONE = "done"
+TIMEOUT = "timeout"
+DISCONNECT = "disconnect"
+DIED = "died"
+
+# a cancelled request in thread mode that did not return in time
+DRAIN = "drain"
+
+# idle workers update their heartbeat this often (in seconds)
+HEARTBEAT_INTERVAL = 1.0
+
+# clients send this message to ask which input dtypes the function supports
+DESCRIBE = b"kaas:describe"
+DEFAULT_DTYPES = ("float64",)
+
+# in process mode, every slot is served by its own worker process
+# in thread mode, one worker process per GPU serves all of its slots on threads
+PROCESS_MODE = "process"
+THREAD_MODE = "thread"
+
+
+class Worker:
+    # a slot that requests can be sent to, several slots may share a process
+
+    def __init__(
+        self,
+        process: mp.Process,
+        pipe: MultiprocessingConnection,
+        heartbeat: typing.Any,
+    ):
+        self.process = process
+        self.pipe = pipe
+        self.heartbeat = heartbeat
+
+    def ready(self) -> bool:
+        # the worker only starts beating once the function has been imported
+        return bool(self.heartbeat.value > 0)
+
+    def heartbeat_age(self) -> float:
+        return time.time() - float(self.heartbeat.value)
+
+    def stop(self) -> None:
+        self.process.kill()
+        self.pipe.close()
+
+
+def _server_alive() -> bool:
+    # if the server is killed without stopping us, we are reparented
+    # (the pipes do not tell us, as our siblings also hold the server's ends)
+    server = mp.parent_process()
+    return server is None or os.getppid() == server.pid
+
+
+def _serve(
+    recver: MultiprocessingConnection,
+    fn: typing.Any,
+    heartbeat: typing.Any,
+) -> None:
+    # beat while idle so that the supervisor can tell a hung worker from a busy one
+    # workers used to stop after 60s of idling, but as the supervisor replaces
+    # every worker that exits, they now run until the server stops them or
+    # goes away
+    heartbeat.value = time.time()
+
+    while _server_alive():
+        try:
+            if recver.poll(HEARTBEAT_INTERVAL):
+                msg = recver.recv()
+                try:
+                    rsp = fn.call(msg)
+                except Exception as e:
+                    print(f"Error: {e}")
+                    rsp = b""
+                heartbeat.value = time.time()
+                recver.send(rsp)
+        except (EOFError, OSError):
+            # the server has closed our pipe
+            return
+
+        heartbeat.value = time.time()
+
 
 def _recv_function(
-    recver: MultiprocessingConnection, function_module: str, cuda_device: int
+    recvers: typing.List[MultiprocessingConnection],
+    function_module: str,
+    cuda_device: int,
+    heartbeats: typing.List[typing.Any],
 ) -> None:
     os.environ["WORKER_GPU"] = str(cuda_device)
 
@@ -34,23 +124,83 @@ def _recv_function(
             f"{function_module}.py is present but method call() could not be found"
         ) from e
 
-    TIMEOUT = 60
+    if len(recvers) == 1:
+        _serve(recvers[0], fn, heartbeats[0])
+        return
+
+    # serve every slot on its own thread, these share one context on the GPU
+    threads = [
+        threading.Thread(target=_serve, args=(recver, fn, heartbeat))
+        for recver, heartbeat in zip(recvers, heartbeats)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    exit(0)
+
+
+def _describe_function(recver: MultiprocessingConnection, function_module: str) -> None:
+    # runs in its own process so that the server never initializes the GPU itself
+    fn = importlib.import_module(function_module)
+    recver.send(tuple(getattr(fn, "DTYPES", DEFAULT_DTYPES)))
+
+
+def _await_worker(
+    worker: Worker,
+    conn: socket.socket,
+    acquired: float,
+    request_timeout: typing.Optional[float],
+) -> typing.Tuple[str, typing.Optional[bytes]]:
+    # wait until the worker answers, the client goes away, or the deadline passes
+    # the deadline only starts once the worker is ready, so that importing the
+    # function (and compiling its kernels) on a cold start does not count
+    pipe = worker.pipe
+    waitables: typing.List[typing.Any] = [pipe, conn]
+    deadline = None
 
     while True:
-        if recver.poll(TIMEOUT):
-            msg = recver.recv()
+        timeout = None
+        if request_timeout is not None:
+            if deadline is None and worker.ready():
+                # the heartbeat still holds the time the worker became ready
+                ready_at = time.perf_counter() - worker.heartbeat_age()
+                deadline = max(acquired, ready_at) + request_timeout
+
+            if deadline is None:
+                timeout = HEARTBEAT_INTERVAL
+            else:
+                timeout = max(0.0, deadline - time.perf_counter())
+
+        ready = mp.connection.wait(waitables, timeout)
+
+        if pipe in ready:
+            try:
+                return DONE, pipe.recv()
+            except (EOFError, OSError):
+                # the worker process is gone
+                return DIED, None
+
+        if conn in ready:
+            # the client does not send anything after its request, so a
+            # readable socket means that it has closed the connection
             try:
-                rsp = fn.call(msg)
-            except Exception as e:
-                print(f"Error: {e}")
-                rsp = b""
-            recver.send(rsp)
+                peek = conn.recv(1, socket.MSG_PEEK)
+            except OSError:
+                peek = b""
+
+            if peek == b"":
+                return DISCONNECT, None
+
+            waitables = [pipe]
             continue
-        break
 
-    print("Time out! Stopping this worker process...", file=sys.stderr)
+        if deadline is None:
+            # the worker is still starting up
+            continue
 
-    exit(0)
+        return TIMEOUT, None
 
 
 #######################################
@@ -86,6 +236,44 @@ if __name__ == "__main__":
         default=1024,
         help="message size buffer to accept for incoming messages",
     )
+    parser.add_argument(
+        "--policy",
+        type=str,
+        choices=list(placement.POLICIES),
+        default=placement.KaasPolicy.name,
+        help="placement policy that decides which worker serves a request and when a new GPU is booted",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=None,
+        help="seconds a request may hold a ready worker before the worker is killed and replaced, cold starts do not count (default: no timeout)",
+    )
+    parser.add_argument(
+        "--warm-spares",
+        type=int,
+        default=0,
+        help="number of spare workers to keep booted per GPU to replace killed workers",
+    )
+    parser.add_argument(
+        "--heartbeat-timeout",
+        type=float,
+        default=10.0,
+        help="seconds without a heartbeat after which an idle worker is considered hung and replaced",
+    )
+    parser.add_argument(
+        "--worker-mode",
+        type=str,
+        choices=[PROCESS_MODE, THREAD_MODE],
+        default=PROCESS_MODE,
+        help="run one worker process per slot, or one worker process per GPU that serves all of its slots on threads",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=60.0,
+        help="in thread mode, seconds a cancelled request may keep its slot before its worker process (with all of its slots) is replaced",
+    )
 
     args = parser.parse_args()
 
@@ -94,104 +282,453 @@ if __name__ == "__main__":
     available_gpus = args.num_gpus
     message_size = args.message_size
     max_req_per_gpu = args.max_req_per_gpu
+    request_timeout = args.request_timeout
+    warm_spares = args.warm_spares
+    heartbeat_timeout = args.heartbeat_timeout
+    worker_mode = args.worker_mode
+    drain_timeout = args.drain_timeout
+
+    # number of slots served by one worker process
+    slots_per_process = 1
+    if worker_mode == THREAD_MODE:
+        slots_per_process = max_req_per_gpu
+    policy = placement.make_policy(args.policy)
 
-    print(f"Starting autoscaling server for function {function}")
+    print(f"Starting autoscaling server for function {function} ({policy.name})")
 
     # boot a few backends
-    servers = []
-    pipes = []
+    # servers has one entry per slot, slots of the same GPU are consecutive
+    servers: typing.List[Worker] = []
+    spares: typing.Dict[int, typing.List[typing.List[Worker]]] = {}
+
+    def _start_process(gpu: int) -> typing.List[Worker]:
+        # starts one worker process and returns the slots it serves
+        recvers = []
+        senders = []
+        heartbeats = []
+        for i in range(slots_per_process):
+            recver, sender = mp.Pipe()
+            recvers.append(recver)
+            senders.append(sender)
+            heartbeats.append(mp.Value("d", 0.0, lock=False))
+
+        p = mp.Process(
+            target=_recv_function,
+            args=(recvers, function, gpu, heartbeats),
+        )
+        p.start()
+
+        # only the worker needs these ends, closing them here lets us notice when it dies
+        for recver in recvers:
+            recver.close()
+
+        return [Worker(p, sender, hb) for sender, hb in zip(senders, heartbeats)]
 
     def _boot_processes(gpu: int) -> None:
-        for i in range(max_req_per_gpu):
-            recver, sender = mp.Pipe()
+        for i in range(max_req_per_gpu // slots_per_process):
+            servers.extend(_start_process(gpu))
+
+        spares[gpu] = [_start_process(gpu) for _ in range(warm_spares)]
+
+    # stores slots that have been replaced but whose replacement is not yet
+    # ready, together with the time and reason their predecessor was replaced
+    recovering: typing.Dict[int, typing.Tuple[float, str]] = {}
+    supervisor_stats: typing.Dict[str, typing.Any] = {
+        "restarts": {},
+        "recover_seconds": [],
+    }
+
+    def _replace_worker(worker: int, reason: str) -> Worker:
+        # kill the process behind a slot and put a warm spare (or a fresh
+        # process if there is no spare) in its place, returns the killed worker
+        # so it can be joined
+        # all slots that shared the process are replaced together
+        # if the replacement is not ready yet, the slots are taken out of
+        # scheduling until the supervisor sees them come up
+        # must be called with the lock held
+        gpu, _ = divmod(worker, max_req_per_gpu)
+
+        old = servers[worker]
+        old.process.kill()
+
+        siblings = [
+            i
+            for i in range(gpu * max_req_per_gpu, (gpu + 1) * max_req_per_gpu)
+            if servers[i].process is old.process
+        ]
+
+        if len(spares[gpu]) > 0:
+            replacement = spares[gpu].pop(0)
+            spares[gpu].append(_start_process(gpu))
+        else:
+            replacement = _start_process(gpu)
+
+        for i, w in zip(siblings, replacement):
+            slot = i - gpu * max_req_per_gpu
+
+            # a request handler may still be waiting on the pipe, it closes the
+            # pipe itself once it sees the worker die
+            if state.worker_load[gpu][slot] == 0:
+                servers[i].pipe.close()
+
+            servers[i] = w
+
+            if i not in recovering:
+                recovering[i] = (time.perf_counter(), reason)
+            state.mark_down(gpu, slot)
+            _check_recovered(i)
+
+        restarts = supervisor_stats["restarts"]
+        restarts[reason] = restarts.get(reason, 0) + 1
+
+        print(
+            f"@@@ Replaced worker {worker} on GPU {gpu} ({reason}) at {time.time()}"
+        )
+
+        return old
+
+    def _check_recovered(worker: int) -> None:
+        # must be called with the lock held
+        if not servers[worker].ready():
+            return
+
+        gpu, slot = divmod(worker, max_req_per_gpu)
+        state.mark_up(gpu, slot)
+
+        replaced, reason = recovering.pop(worker)
+        recover_seconds = time.perf_counter() - replaced
+        supervisor_stats["recover_seconds"].append(recover_seconds)
+
+        if reason in (TIMEOUT, DISCONNECT, DRAIN):
+            cancel_stats["replace_seconds"] += recover_seconds
+
+        print(
+            f"@@@ Recovered worker {worker} on GPU {gpu} after {round(recover_seconds, 3)}s"
+        )
+
+    def _busy(worker: int) -> bool:
+        # must be called with the lock held
+        gpu, slot = divmod(worker, max_req_per_gpu)
+        return state.worker_load[gpu][slot] > 0
+
+    stopping = threading.Event()
+
+    def _supervise() -> None:
+        while not stopping.is_set():
+            with lock:
+                watched = {w.process.sentinel: w for w in servers}
+                for gpu_spares in spares.values():
+                    for group in gpu_spares:
+                        watched[group[0].process.sentinel] = group[0]
 
-            p = mp.Process(target=_recv_function, args=(recver, function, gpu))
-            p.start()
+            exited = mp.connection.wait(list(watched), HEARTBEAT_INTERVAL)
 
-            servers.append(p)
-            pipes.append(sender)
+            with lock:
+                if stopping.is_set():
+                    return
+
+                for sentinel in exited:
+                    dead = watched[sentinel]
+
+                    # the worker may already have been replaced by a request handler
+                    if dead in servers:
+                        # blame a slot that was serving a request when its
+                        # process went down, if there was one
+                        slots = [
+                            i
+                            for i, w in enumerate(servers)
+                            if w.process is dead.process
+                        ]
+                        busy = [i for i in slots if _busy(i)]
+                        _replace_worker((busy + slots)[0], "exited").process.join()
+                        continue
+
+                    for gpu, gpu_spares in spares.items():
+                        for i, group in enumerate(gpu_spares):
+                            if group[0] is not dead:
+                                continue
+
+                            for w in group:
+                                w.stop()
+                            dead.process.join()
+                            gpu_spares[i] = _start_process(gpu)
+                            restarts = supervisor_stats["restarts"]
+                            restarts["spare"] = restarts.get("spare", 0) + 1
+
+                for worker in range(len(servers)):
+                    if worker in recovering:
+                        _check_recovered(worker)
+
+                # all slots of a process are replaced together, so a process
+                # only counts as hung if none of its slots has beaten recently
+                # a slot that is busy with a request does not beat, and we do
+                # not take down requests of a process that may only be slow
+                for first in range(0, len(servers), slots_per_process):
+                    slots = range(first, first + slots_per_process)
+                    if any(i in recovering for i in slots):
+                        continue
+
+                    if any(_busy(i) for i in slots):
+                        continue
+
+                    ages = {i: servers[i].heartbeat_age() for i in slots}
+                    if all(servers[i].ready() for i in slots) and all(
+                        age > heartbeat_timeout for age in ages.values()
+                    ):
+                        # log the slot that stopped beating first
+                        stalest = max(ages, key=lambda i: ages[i])
+                        _replace_worker(stalest, "hung").process.join()
 
     def _stop_processes(signum: int, frame: typing.Optional[typing.Any]) -> None:
         print(f"Recved signal {signum}, stopping processes", end="", file=sys.stderr)
+        stopping.set()
         with warnings.catch_warnings():
             warnings.simplefilter("ignore")
             for i in range(len(servers)):
-                servers[i].join(1)
-                servers[i].kill()
-                pipes[i].close()
+                servers[i].process.join(1)
+                servers[i].stop()
                 print(".", end="", file=sys.stderr)
+            for gpu_spares in spares.values():
+                for group in gpu_spares:
+                    for w in group:
+                        w.stop()
         print("\n", end="", file=sys.stderr)
+        stats = policy.stats()
+        print(
+            f"@@@ Policy {stats['policy']}: {stats['placements']} placements, {stats['boots']} boots, {stats['rejections']} rejections, {stats['slot_seconds']} slot-seconds"
+        )
+        print(
+            f"@@@ Cancelled {cancel_stats[TIMEOUT]} timed out and {cancel_stats[DISCONNECT]} disconnected requests after {round(cancel_stats['held_seconds'], 3)} slot-seconds, recovered ~{round(cancel_stats['recovered_slot_seconds'], 3)} slot-seconds ({cancel_stats['unestimated']} without estimate), slots down for {round(cancel_stats['replace_seconds'], 3)}s while replacing"
+        )
+        recover_seconds = supervisor_stats["recover_seconds"]
+        mean_recover = 0.0
+        if len(recover_seconds) > 0:
+            mean_recover = sum(recover_seconds) / len(recover_seconds)
+        print(
+            f"@@@ Supervisor: restarts {supervisor_stats['restarts']}, {len(recover_seconds)} recoveries, mean time-to-recover {round(mean_recover, 3)}s"
+        )
         print(f"Exiting...", file=sys.stderr)
         exit(0)
 
+    # stores the number of in-flight requests per worker
+    state = placement.ClusterState(available_gpus, max_req_per_gpu)
+    lock = threading.Lock()
+
+    # cancelled requests, the slot time they held, the slot time we got back
+    # by not waiting for them (estimated from completed requests that took
+    # longer), and how long their slots were down while being replaced
+    cancel_stats: typing.Dict[str, typing.Any] = {
+        TIMEOUT: 0,
+        DISCONNECT: 0,
+        "held_seconds": 0.0,
+        "recovered_slot_seconds": 0.0,
+        "unestimated": 0,
+        "replace_seconds": 0.0,
+    }
+
+    # service times of completed requests, sorted
+    service_seconds: typing.List[float] = []
+
+    def _remaining_service(held: float) -> typing.Optional[float]:
+        # expected remaining service time of a request that has held its slot
+        # for held seconds, or None if no completed request took that long
+        # must be called with the lock held
+        longer = service_seconds[bisect.bisect_right(service_seconds, held) :]
+        if len(longer) == 0:
+            return None
+        return sum(longer) / len(longer) - held
+
+    # everything the handlers use must exist before they are installed
     signal.signal(signal.SIGINT, _stop_processes)
     signal.signal(signal.SIGTERM, _stop_processes)
 
+    # find out which dtypes the function supports before accepting requests
+    recver, sender = mp.Pipe()
+    probe = mp.Process(target=_describe_function, args=(recver, function))
+    probe.start()
+    recver.close()
+    try:
+        function_dtypes = sender.recv()
+    except EOFError:
+        print(
+            f"Could not describe function {function}, assuming dtypes {DEFAULT_DTYPES}",
+            file=sys.stderr,
+        )
+        function_dtypes = DEFAULT_DTYPES
+    probe.join()
+    sender.close()
+
+    print(f"Function supports dtypes {', '.join(function_dtypes)}")
+
     print("Server ready!")
 
-    # stores the number of in-flight requests per worker
-    gpu_load: typing.List[int] = []
-    worker_load: typing.Dict[int, typing.List[int]] = {}
-    lock = threading.Lock()
+    supervisor = threading.Thread(target=_supervise, daemon=True)
+    supervisor.start()
 
     class ThreadedTCPRequestHandler(socketserver.BaseRequestHandler):
         def handle(self) -> None:
-            global gpu_load
-            global worker_load
+            global state
             global lock
+
+            msg = self.request.recv(message_size)
+
+            # answer capability queries without taking up a worker
+            if msg == DESCRIBE:
+                self.request.sendall(pickle.dumps(function_dtypes))
+                return
+
             with lock:
-                cold_start = False
-                # find the gpu with the least in-flight requests
-                if len(gpu_load) > 0:
-                    gpu_to_use = gpu_load.index(min(gpu_load))
-                    avail_worker = worker_load[gpu_to_use].index(
-                        min(worker_load[gpu_to_use])
-                    )
-                    worker_to_use = gpu_to_use * max_req_per_gpu + avail_worker
+                # let the placement policy pick a worker
+                # if it decides to boot, the new GPU has already been added to the state
+                decision = policy.place(state)
 
-                # if all workers are full, boot new ones on the next GPU
                 # only boot a new worker if there are still GPUs available
                 # in theory, we would otherwise just need to wait
                 # but we will not try this out here
-                if len(gpu_load) == 0 or worker_load[gpu_to_use][avail_worker] >= 1:
-                    if len(servers) >= available_gpus * max_req_per_gpu:
-                        print(f"@@@ ERROR all workers are full at {time.time()}")
-                        _ = self.request.recv(message_size)
-                        self.request.sendall(struct.pack("?f", False, 0.0))
-                        return
+                if decision.action == placement.REJECT:
+                    print(f"@@@ ERROR all workers are full at {time.time()}")
+                    self.request.sendall(struct.pack("?f", False, 0.0))
+                    return
 
-                    next_gpu = len(gpu_load)
+                gpu_to_use = decision.gpu
+                avail_worker = decision.slot
+                worker_to_use = gpu_to_use * max_req_per_gpu + avail_worker
+                cold_start = decision.action == placement.BOOT
 
+                if cold_start:
                     # start new workers on the next GPU
-                    _boot_processes(next_gpu)
+                    _boot_processes(gpu_to_use)
                     print(
-                        f"@@@ Booted {max_req_per_gpu} new workers on GPU {next_gpu} at {time.time()}"
+                        f"@@@ Booted {max_req_per_gpu} new workers on GPU {gpu_to_use} at {time.time()}"
                     )
 
-                    # add a new entry to the gpu load list
-                    gpu_load.append(0)
-                    worker_load[next_gpu] = [0] * max_req_per_gpu
+                print(f"Using worker {worker_to_use} on GPU {gpu_to_use}")
 
-                    avail_worker = 0
-                    worker_to_use = next_gpu * max_req_per_gpu + avail_worker
-                    gpu_to_use = next_gpu
-                    cold_start = True
+            acquired = time.perf_counter()
 
-                # increment the in-flight count for the worker
-                gpu_load[gpu_to_use] = gpu_load[gpu_to_use] + 1
-                worker_load[gpu_to_use][avail_worker] = 1
-                print(f"Using worker {worker_to_use} on GPU {gpu_to_use}")
+            worker = servers[worker_to_use]
 
-            msg = self.request.recv(message_size)
-            pipes[worker_to_use].send(msg)
-            rsp = pipes[worker_to_use].recv()
-            inner_time = struct.unpack("f", rsp)[0]
+            try:
+                worker.pipe.send(msg)
+                outcome, rsp = _await_worker(
+                    worker, self.request, acquired, request_timeout
+                )
+            except OSError:
+                outcome, rsp = DIED, None
+
+            if outcome == DIED:
+                held = time.perf_counter() - acquired
+                with lock:
+                    # the supervisor may have beaten us to replacing it
+                    if servers[worker_to_use] is worker:
+                        _replace_worker(worker_to_use, DIED)
+                    policy.release(state, gpu_to_use, avail_worker, held)
+
+                worker.pipe.close()
+
+                try:
+                    self.request.sendall(struct.pack("?f", cold_start, 0.0))
+                except OSError:
+                    pass
+                return
+
+            if outcome != DONE and worker_mode == THREAD_MODE:
+                # killing the worker would take down the other slots of its
+                # process, so we answer the client now and keep the slot until
+                # the function returns
+                if outcome == TIMEOUT:
+                    try:
+                        self.request.sendall(struct.pack("?f", cold_start, 0.0))
+                    except OSError:
+                        pass
+
+                with lock:
+                    cancel_stats[outcome] += 1
+                    print(
+                        f"@@@ Cancelled request on worker {worker_to_use} on GPU {gpu_to_use} ({outcome}, draining) at {time.time()}"
+                    )
+
+                # a function that never returns (e.g., one that waits for the
+                # tiles of a streamed client that went away) would hold the
+                # slot for good, so we only wait that long
+                drained = True
+                try:
+                    if worker.pipe.poll(drain_timeout):
+                        worker.pipe.recv()
+                    else:
+                        drained = False
+                except (EOFError, OSError):
+                    # the process died in the meantime and has been replaced
+                    worker.pipe.close()
+
+                if drained:
+                    with lock:
+                        policy.release(
+                            state,
+                            gpu_to_use,
+                            avail_worker,
+                            time.perf_counter() - acquired,
+                        )
+                    return
+
+                with lock:
+                    # this takes down the other slots of the process as well
+                    killed = worker
+                    if servers[worker_to_use] is worker:
+                        killed = _replace_worker(worker_to_use, DRAIN)
+                    policy.release(
+                        state, gpu_to_use, avail_worker, time.perf_counter() - acquired
+                    )
+
+                worker.pipe.close()
+                killed.process.join()
+                return
+
+            if outcome != DONE:
+                # the worker is still computing for nobody, replace it so the
+                # slot is available again right away
+                held = time.perf_counter() - acquired
+                with lock:
+                    # the supervisor may have replaced it already if it died
+                    # just now, then we must not kill its replacement
+                    killed = worker
+                    if servers[worker_to_use] is worker:
+                        killed = _replace_worker(worker_to_use, outcome)
+                    policy.release(state, gpu_to_use, avail_worker, held)
+
+                    cancel_stats[outcome] += 1
+                    cancel_stats["held_seconds"] += held
+
+                    remaining = _remaining_service(held)
+                    if remaining is None:
+                        cancel_stats["unestimated"] += 1
+                    else:
+                        cancel_stats["recovered_slot_seconds"] += remaining
+                    print(
+                        f"@@@ Cancelled request on worker {worker_to_use} on GPU {gpu_to_use} ({outcome}) at {time.time()}"
+                    )
+
+                killed.pipe.close()
+                killed.process.join()
+
+                if outcome == TIMEOUT:
+                    try:
+                        self.request.sendall(struct.pack("?f", cold_start, 0.0))
+                    except OSError:
+                        pass
+                return
+
+            # the worker answers with an empty response if the function failed
+            inner_time = 0.0
+            if rsp is not None and len(rsp) == struct.calcsize("f"):
+                inner_time = struct.unpack("f", rsp)[0]
             self.request.sendall(struct.pack("?f", cold_start, inner_time))
 
             with lock:
-                # decrement the in-flight count for the worker to release resource
-                gpu_load[gpu_to_use] = gpu_load[gpu_to_use] - 1
-                worker_load[gpu_to_use][avail_worker] = 0
+                # release the worker slot and account for the time it was held
+                held = time.perf_counter() - acquired
+                policy.release(state, gpu_to_use, avail_worker, held)
+                bisect.insort(service_seconds, held)
                 print(f"Released worker {worker_to_use} on GPU {gpu_to_use}")
 
     class ThreadedTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
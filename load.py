@@ -7,6 +7,7 @@ import multiprocessing as mp
 import os
 import threading
 import time
+import typing
 
 
 class Log:
@@ -18,6 +19,8 @@ class Log:
         setup_time_ms: str,
         cold_start: str,
         copy: int,
+        concurrency: typing.Optional[int] = None,
+        scheduled: typing.Optional[float] = None,
     ):
         self.timestamp = timestamp
         self.inner_time_ms = inner_time_ms
@@ -25,15 +28,49 @@ class Log:
         self.setup_time_ms = setup_time_ms
         self.cold_start = cold_start
         self.copy = copy
+        # only set when replaying a trace
+        self.concurrency = concurrency
+        self.scheduled = scheduled
 
 
-def _worker(
-    client: str,
-    arg: str,
-    copy: int,
-    log_queue: mp.Queue,  # type: ignore
-    term_queue: mp.Queue,  # type: ignore
-) -> None:
+def load_trace(trace_file: str, speedup: float = 1.0) -> typing.List[float]:
+    # returns the arrival times in a trace as seconds since its start, divided by speedup
+    # a trace is either one of our results CSVs (with a timestamp column) or
+    # a file of per-second invocation counts, with one count per line or
+    # second,count pairs per line
+    with open(trace_file, "r") as f:
+        rows = [line.strip().split(",") for line in f.readlines() if line.strip()]
+
+    arrivals: typing.List[float] = []
+
+    if len(rows) == 0:
+        return arrivals
+
+    if "timestamp" in rows[0]:
+        col = rows[0].index("timestamp")
+        timestamps = sorted(float(row[col]) for row in rows[1:])
+        arrivals = [t - timestamps[0] for t in timestamps]
+
+    else:
+        # skip a header if there is one
+        try:
+            float(rows[0][-1])
+        except ValueError:
+            rows = rows[1:]
+
+        for i, row in enumerate(rows):
+            second = float(row[0]) if len(row) > 1 else float(i)
+            count = int(float(row[-1]))
+
+            # spread the invocations of a second evenly across it
+            arrivals.extend(second + k / count for k in range(count))
+
+        arrivals.sort()
+
+    return [a / speedup for a in arrivals]
+
+
+def _load_client(client: str, arg: str, copy: int) -> typing.Any:
     try:
         fn = importlib.import_module(client)
     except Exception as e:
@@ -55,6 +92,27 @@ def _worker(
     except AttributeError as e:
         print("No prepare() method found, skipping")
 
+    return fn
+
+
+def _cleanup_client(fn: typing.Any) -> None:
+    try:
+        getattr(fn, "cleanup")
+        fn.cleanup()
+
+    except AttributeError as e:
+        print("No clean() method found, skipping")
+
+
+def _worker(
+    client: str,
+    arg: str,
+    copy: int,
+    log_queue: mp.Queue,  # type: ignore
+    term_queue: mp.Queue,  # type: ignore
+) -> None:
+    fn = _load_client(client, arg, copy)
+
     while True:
         try:
             # see if we should terminate
@@ -83,12 +141,58 @@ def _worker(
             )
         )
 
-    try:
-        getattr(fn, "cleanup")
-        fn.cleanup()
+    _cleanup_client(fn)
 
-    except AttributeError as e:
-        print("No clean() method found, skipping")
+
+def _replay_worker(
+    client: str,
+    arg: str,
+    copy: int,
+    log_queue: mp.Queue,  # type: ignore
+    job_queue: mp.Queue,  # type: ignore
+    ready_queue: mp.Queue,  # type: ignore
+    in_flight: typing.Any,
+) -> None:
+    # sends one request for every scheduled arrival time it gets from the job queue
+    fn = _load_client(client, arg, copy)
+
+    ready_queue.put(copy)
+
+    while True:
+        scheduled = job_queue.get()
+        if scheduled is None:
+            break
+
+        with in_flight.get_lock():
+            in_flight.value += 1
+            concurrency = in_flight.value
+
+        t_0 = time.perf_counter()
+        ts = time.time()
+
+        _, inner_time_ms, setup_time_ms, cold_start = fn.run_client(arg)
+
+        t_1 = time.perf_counter()
+
+        with in_flight.get_lock():
+            in_flight.value -= 1
+
+        outer_time_ms = str(round((t_1 - t_0) * 1000, 5))
+
+        log_queue.put(
+            Log(
+                timestamp=ts,
+                inner_time_ms=inner_time_ms,
+                outer_time_ms=outer_time_ms,
+                setup_time_ms=setup_time_ms,
+                cold_start=cold_start,
+                copy=copy,
+                concurrency=concurrency,
+                scheduled=scheduled,
+            )
+        )
+
+    _cleanup_client(fn)
 
 
 if __name__ == "__main__":
@@ -159,12 +263,44 @@ if __name__ == "__main__":
         help="interval until next step in seconds.",
     )
 
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="replay the arrivals in a trace instead of ramping up clients. either a results CSV with a timestamp column or a file of per-second invocation counts. --max-parallel sets the number of clients sending requests.",
+    )
+
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        default=1.0,
+        help="time compression factor for the trace, e.g., 2 replays it twice as fast.",
+    )
+
     args = parser.parse_args()
 
     # we start a worker that logs everything
     # we start min_parallel workers
     # each worker continuously sends requests to the server, until the program ends
     # we start a new worker every interval seconds
+    # when replaying a trace, we start max_parallel workers that each send a
+    # request when the trace says so
+
+    arrivals: typing.List[float] = []
+    if args.trace is not None:
+        if args.max_parallel is None or args.max_parallel < 1:
+            print("Replaying a trace needs --max-parallel (number of clients) of at least 1")
+            exit(-1)
+
+        if args.speedup <= 0:
+            print("--speedup must be positive")
+            exit(-1)
+
+        arrivals = load_trace(args.trace, args.speedup)
+
+        if len(arrivals) == 0:
+            print(f"Trace {args.trace} contains no requests")
+            exit(-1)
 
     # some prep work:
     # create a directory for results (if it does not exist)
@@ -173,6 +309,9 @@ if __name__ == "__main__":
 
     results_file = f"{results_dir}/{args.task_name}.csv"
 
+    # scheduled and actual send time of every request in the trace
+    replay_file = f"{results_dir}/{args.task_name}-replay.csv"
+
     # create a markdown file that saves the parameters (in Eitan's spirit)
     description_file = f"{results_dir}/{args.task_name}.md"
 
@@ -196,6 +335,12 @@ if __name__ == "__main__":
         f.write(f"Step size: {args.step_size}\n")
         f.write(f"Interval: {args.interval}\n")
 
+        if args.trace is not None:
+            f.write(f"Trace: {args.trace}\n")
+            f.write(f"Speedup: {args.speedup}\n")
+            f.write(f"Arrivals: {len(arrivals)}\n")
+            f.write(f"Replay fidelity: {replay_file}\n")
+
         f.write("\n")
 
     # now let's start with the actual experiment
@@ -203,10 +348,18 @@ if __name__ == "__main__":
 
     concurrency = args.min_parallel
 
+    # lag between scheduled and actual send time when replaying a trace
+    lags_ms: typing.List[float] = []
+
     # start the worker that logs everything
     def _logger(log_queue: mp.Queue) -> None:  # type: ignore
         global concurrency
 
+        replay_f = None
+        if args.trace is not None:
+            replay_f = open(replay_file, "w")
+            replay_f.write("scheduled,actual,lag_ms,copy\n")
+
         with open(results_file, "w") as f:
             f.write(
                 "timestamp,inner_time_ms,outer_time_ms,setup_time,cold_start,copy,concurrency\n"
@@ -217,9 +370,19 @@ if __name__ == "__main__":
                 if result == "END":
                     break
 
+                # in a replay, concurrency is the number of requests in flight
+                c = concurrency if result.concurrency is None else result.concurrency
+
                 f.write(
-                    f"{result.timestamp},{result.inner_time_ms},{result.outer_time_ms},{result.setup_time_ms},{result.cold_start},{result.copy},{concurrency}\n"
+                    f"{result.timestamp},{result.inner_time_ms},{result.outer_time_ms},{result.setup_time_ms},{result.cold_start},{result.copy},{c}\n"
                 )
+
+                if replay_f is not None and result.scheduled is not None:
+                    lag_ms = round((result.timestamp - result.scheduled) * 1000, 5)
+                    lags_ms.append(lag_ms)
+                    replay_f.write(
+                        f"{result.scheduled},{result.timestamp},{lag_ms},{result.copy}\n"
+                    )
                 print(
                     "Outer time: ",
                     float(result.outer_time_ms) / 1000.0,
@@ -232,48 +395,93 @@ if __name__ == "__main__":
     workers = []
     term_queue = mp.Queue()  # type: ignore
 
-    for i in range(concurrency):
-        worker = mp.Process(
-            target=_worker,
-            args=(
-                args.client,
-                args.input,
-                i,
-                results_queue,
-                term_queue,
-            ),
+    if args.trace is not None:
+        job_queue = mp.Queue()  # type: ignore
+        ready_queue = mp.Queue()  # type: ignore
+        in_flight = mp.Value("i", 0)
+
+        for i in range(args.max_parallel):
+            worker = mp.Process(
+                target=_replay_worker,
+                args=(
+                    args.client,
+                    args.input,
+                    i,
+                    results_queue,
+                    job_queue,
+                    ready_queue,
+                    in_flight,
+                ),
+            )
+            worker.start()
+            workers.append(worker)
+
+        # wait until all clients have prepared their input
+        for worker in workers:
+            ready_queue.get()
+
+        print(
+            f"Started {len(workers)} clients, replaying {len(arrivals)} requests over {arrivals[-1] if arrivals else 0.0:.1f}s ({time.time()})"
         )
-        worker.start()
-        workers.append(worker)
-        print(f"Started client {i} ({time.time()})")
 
-    # now we start the actual experiment
-    while concurrency < args.max_parallel:
-        time.sleep(args.interval)
+        replay_start = time.time()
+
+        for offset in arrivals:
+            scheduled = replay_start + offset
+
+            delay = scheduled - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            job_queue.put(scheduled)
 
-        for i in range(args.step_size):
-            # start a new worker
+        # no more requests
+        for worker in workers:
+            job_queue.put(None)
+
+    else:
+        for i in range(concurrency):
             worker = mp.Process(
                 target=_worker,
                 args=(
                     args.client,
                     args.input,
-                    concurrency + i,
+                    i,
                     results_queue,
                     term_queue,
                 ),
             )
             worker.start()
             workers.append(worker)
-            print(f"Started client {concurrency + i} ({time.time()})")
+            print(f"Started client {i} ({time.time()})")
+
+        # now we start the actual experiment
+        while concurrency < args.max_parallel:
+            time.sleep(args.interval)
+
+            for i in range(args.step_size):
+                # start a new worker
+                worker = mp.Process(
+                    target=_worker,
+                    args=(
+                        args.client,
+                        args.input,
+                        concurrency + i,
+                        results_queue,
+                        term_queue,
+                    ),
+                )
+                worker.start()
+                workers.append(worker)
+                print(f"Started client {concurrency + i} ({time.time()})")
 
-        concurrency += args.step_size
+            concurrency += args.step_size
 
-    time.sleep(args.interval)
+        time.sleep(args.interval)
 
-    # stop all workers
-    for worker in workers:
-        term_queue.put(True)
+        # stop all workers
+        for worker in workers:
+            term_queue.put(True)
 
     for worker in workers:
         worker.join()
@@ -291,3 +499,15 @@ if __name__ == "__main__":
         f.write(
             f"The experiment ran for {datetime.datetime.now(datetime.timezone.utc) - start_time}.\n"
         )
+
+        if lags_ms:
+            lags_ms.sort()
+            f.write("\n")
+            f.write("## Replay Fidelity\n")
+            f.write(f"Requests sent: {len(lags_ms)} of {len(arrivals)}\n")
+            f.write(f"Mean lag: {sum(lags_ms) / len(lags_ms):.3f}ms\n")
+            f.write(f"Median lag: {lags_ms[len(lags_ms) // 2]:.3f}ms\n")
+            f.write(
+                f"99th percentile lag: {lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]:.3f}ms\n"
+            )
+            f.write(f"Maximum lag: {lags_ms[-1]:.3f}ms\n")
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+# A function that does nothing, used to measure the overhead of the KaaS platform
+# without any kernel time.
+
+import struct
+import time
+
+# the input is never read, so any dtype works
+DTYPES = ("float16", "float32", "float64")
+
+
+def call(p: bytes) -> bytes:
+    start = time.perf_counter()
+
+    inner_time = time.perf_counter() - start
+
+    return struct.pack("f", inner_time)
+
+
+if __name__ == "__main__":
+    inner_time = struct.unpack("f", call(b""))[0]
+
+    print(f"@@@ Elapsed inner time (ms): {round(inner_time*1000, 3)}")
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# Placement policies for the KaaS autoscaling server.
+# A policy looks at the current cluster state (which GPUs are booted and which
+# worker slots on them are busy) and decides where to run the next request:
+# on an existing slot, on a newly booted GPU, or nowhere (reject).
+
+import random
+import typing
+
+PLACE = "place"
+BOOT = "boot"
+REJECT = "reject"
+
+
+class Decision(typing.NamedTuple):
+    action: str
+    gpu: int = -1
+    slot: int = -1
+
+
+class ClusterState:
+    def __init__(self, available_gpus: int, max_req_per_gpu: int):
+        self.available_gpus = available_gpus
+        self.max_req_per_gpu = max_req_per_gpu
+
+        # stores whether a worker slot is busy (1) or free (0) for every booted GPU
+        self.worker_load: typing.List[typing.List[int]] = []
+
+        # slots whose worker died and is being replaced, these cannot be used
+        self.down: typing.Set[typing.Tuple[int, int]] = set()
+
+    @property
+    def gpu_load(self) -> typing.List[int]:
+        # a slot that is down counts as occupied
+        return [
+            sum(
+                1 if load > 0 or (gpu, slot) in self.down else 0
+                for slot, load in enumerate(slots)
+            )
+            for gpu, slots in enumerate(self.worker_load)
+        ]
+
+    def booted_gpus(self) -> int:
+        return len(self.worker_load)
+
+    def can_boot(self) -> bool:
+        return self.booted_gpus() < self.available_gpus
+
+    def free_slot(self, gpu: int) -> int:
+        # returns the first free slot on the GPU or -1 if the GPU is full
+        for slot, load in enumerate(self.worker_load[gpu]):
+            if load == 0 and (gpu, slot) not in self.down:
+                return slot
+        return -1
+
+    def add_gpu(self) -> int:
+        self.worker_load.append([0] * self.max_req_per_gpu)
+        return len(self.worker_load) - 1
+
+    def acquire(self, gpu: int, slot: int) -> None:
+        self.worker_load[gpu][slot] = 1
+
+    def release(self, gpu: int, slot: int) -> None:
+        self.worker_load[gpu][slot] = 0
+
+    def mark_down(self, gpu: int, slot: int) -> None:
+        self.down.add((gpu, slot))
+
+    def mark_up(self, gpu: int, slot: int) -> None:
+        self.down.discard((gpu, slot))
+
+
+class PlacementPolicy:
+    name = ""
+
+    def __init__(self) -> None:
+        self.placements = 0
+        self.boots = 0
+        self.rejections = 0
+        self.slot_seconds = 0.0
+
+    def choose(self, state: ClusterState) -> Decision:
+        raise NotImplementedError
+
+    def place(self, state: ClusterState) -> Decision:
+        decision = self.choose(state)
+
+        if decision.action == REJECT:
+            self.rejections += 1
+            return decision
+
+        if decision.action == BOOT:
+            gpu = state.add_gpu()
+            decision = Decision(BOOT, gpu, 0)
+            self.boots += 1
+
+        state.acquire(decision.gpu, decision.slot)
+        self.placements += 1
+
+        return decision
+
+    def release(self, state: ClusterState, gpu: int, slot: int, held: float) -> None:
+        state.release(gpu, slot)
+        self.slot_seconds += held
+
+    def _boot_or_reject(self, state: ClusterState) -> Decision:
+        if state.can_boot():
+            return Decision(BOOT)
+        return Decision(REJECT)
+
+    def stats(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "policy": self.name,
+            "placements": self.placements,
+            "boots": self.boots,
+            "rejections": self.rejections,
+            "slot_seconds": round(self.slot_seconds, 3),
+        }
+
+
+class KaasPolicy(PlacementPolicy):
+    # use the GPU with the least in-flight requests, only boot a new GPU when
+    # all booted GPUs are full (this is the original KaaS behavior)
+    name = "kaas"
+
+    def choose(self, state: ClusterState) -> Decision:
+        if state.booted_gpus() == 0:
+            return self._boot_or_reject(state)
+
+        gpu_load = state.gpu_load
+        gpu = gpu_load.index(min(gpu_load))
+        slot = state.free_slot(gpu)
+
+        if slot < 0:
+            return self._boot_or_reject(state)
+
+        return Decision(PLACE, gpu, slot)
+
+
+class SpreadPolicy(PlacementPolicy):
+    # give every request a GPU of its own for as long as possible: boot a new
+    # GPU whenever the least loaded one already has work, and only share GPUs
+    # once all of them are booted
+    name = "spread"
+
+    def choose(self, state: ClusterState) -> Decision:
+        if state.booted_gpus() == 0:
+            return self._boot_or_reject(state)
+
+        gpu_load = state.gpu_load
+        gpu = gpu_load.index(min(gpu_load))
+
+        if gpu_load[gpu] > 0 and state.can_boot():
+            return Decision(BOOT)
+
+        slot = state.free_slot(gpu)
+
+        if slot < 0:
+            return self._boot_or_reject(state)
+
+        return Decision(PLACE, gpu, slot)
+
+
+class BinPackPolicy(PlacementPolicy):
+    # fill up the most loaded GPU that still has a free slot before opening a
+    # new one, so that as few GPUs as possible are powered up
+    name = "binpack"
+
+    def choose(self, state: ClusterState) -> Decision:
+        best_gpu = -1
+        best_load = -1
+
+        for gpu, load in enumerate(state.gpu_load):
+            if load < state.max_req_per_gpu and load > best_load:
+                best_gpu = gpu
+                best_load = load
+
+        if best_gpu < 0:
+            return self._boot_or_reject(state)
+
+        return Decision(PLACE, best_gpu, state.free_slot(best_gpu))
+
+
+class PowerOfTwoChoicesPolicy(PlacementPolicy):
+    # sample two booted GPUs at random and use the less loaded one
+    # if both samples are full, boot a new GPU or, if none are left, fall back
+    # to any free slot in the cluster
+    name = "p2c"
+
+    def __init__(self, seed: typing.Optional[int] = None) -> None:
+        super().__init__()
+        self.rng = random.Random(seed)
+
+    def choose(self, state: ClusterState) -> Decision:
+        booted = state.booted_gpus()
+        if booted == 0:
+            return self._boot_or_reject(state)
+
+        gpu_load = state.gpu_load
+        candidates = self.rng.sample(range(booted), min(2, booted))
+        gpu = min(candidates, key=lambda g: gpu_load[g])
+        slot = state.free_slot(gpu)
+
+        if slot >= 0:
+            return Decision(PLACE, gpu, slot)
+
+        if state.can_boot():
+            return Decision(BOOT)
+
+        for gpu in range(booted):
+            slot = state.free_slot(gpu)
+            if slot >= 0:
+                return Decision(PLACE, gpu, slot)
+
+        return Decision(REJECT)
+
+
+POLICIES: typing.Dict[str, typing.Type[PlacementPolicy]] = {
+    KaasPolicy.name: KaasPolicy,
+    SpreadPolicy.name: SpreadPolicy,
+    BinPackPolicy.name: BinPackPolicy,
+    PowerOfTwoChoicesPolicy.name: PowerOfTwoChoicesPolicy,
+}
+
+
+def make_policy(name: str) -> PlacementPolicy:
+    try:
+        return POLICIES[name]()
+    except KeyError as e:
+        raise ValueError(
+            f"unknown placement policy {name}, choose one of {', '.join(POLICIES)}"
+        ) from e
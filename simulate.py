@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+# Discrete-event simulator of the autoscaling experiment.
+# Requests are placed by the same placement policies the server uses (placement.py),
+# but on a virtual clock: client setup times, service times, and cold start
+# delays are sampled from recorded runs (results-autoscaling/ by default).
+# Clients are driven like in load.py, either by ramping up or by replaying a
+# trace, and results are written in the same format as load.py and
+# sortserverlogs.py so that the existing analysis works on simulated runs.
+
+import argparse
+import bisect
+import datetime
+import glob
+import heapq
+import os
+import random
+import time
+import typing
+
+import load
+import placement
+
+
+def _nearest(levels: typing.List[int], key: int) -> int:
+    # closest recorded level to key, levels are sorted
+    i = bisect.bisect_left(levels, key)
+    if i == 0:
+        return levels[0]
+    if i == len(levels):
+        return levels[-1]
+    before, after = levels[i - 1], levels[i]
+    return before if key - before <= after - key else after
+
+
+class LatencyModel:
+    # empirical latency distributions from the results and server logs of recorded runs
+    # client setup times are grouped by how many clients were running, service
+    # times by how many requests shared the GPU: we estimate that for every
+    # recorded request from the concurrency and the GPUs booted at the time
+    def __init__(self, files: typing.List[str], rng: random.Random):
+        self.rng = rng
+
+        # files that actually contained client results
+        self.files: typing.List[str] = []
+
+        # setup_time_ms of requests by concurrency
+        self.setup: typing.Dict[int, typing.List[float]] = {}
+
+        # (inner_time_ms, overhead_ms) of warm requests by requests per GPU
+        self.warm: typing.Dict[int, typing.List[typing.Tuple[float, float]]] = {}
+
+        # overhead_ms of cold requests
+        cold: typing.List[float] = []
+
+        # time from sending a request to getting rejected
+        self.reject_delays_ms: typing.List[float] = []
+
+        results: typing.List[typing.Tuple[str, typing.List[str], typing.List[str]]] = []
+
+        # (timestamp, num_workers) of every GPU boot in the server logs
+        boots: typing.List[typing.Tuple[float, int]] = []
+
+        for file in files:
+            with open(file, "r") as f:
+                header = f.readline().strip().split(",")
+                lines = f.readlines()
+
+            # skip GPU monitoring
+            if "inner_time_ms" in header:
+                results.append((file, header, lines))
+            elif "num_workers" in header:
+                for line in lines:
+                    num_workers, _, timestamp = line.strip().split(",")
+                    # rejections are logged with 0 workers
+                    if int(num_workers) > 0:
+                        boots.append((float(timestamp), int(num_workers)))
+
+        boots.sort()
+
+        for file, header, lines in results:
+            col = {name: i for i, name in enumerate(header)}
+            rows = [line.strip().split(",") for line in lines if line.strip()]
+            if len(rows) == 0:
+                continue
+
+            # the server logs of a run are the boots during it
+            first = min(float(e[col["timestamp"]]) for e in rows)
+            last = max(float(e[col["timestamp"]]) for e in rows)
+            run_boots = [b for b in boots if first - 5 <= b[0] <= last]
+            if len(run_boots) == 0:
+                raise ValueError(f"no server logs found for the recorded run {file}")
+
+            boot_times = [t for t, _ in run_boots]
+            workers_per_gpu = max(n for _, n in run_boots)
+
+            self.files.append(file)
+
+            for e in rows:
+                timestamp = float(e[col["timestamp"]])
+                inner_time_ms = float(e[col["inner_time_ms"]])
+                setup_time_ms = float(e[col["setup_time"]])
+                outer_time_ms = float(e[col["outer_time_ms"]])
+                concurrency = int(e[col["concurrency"]])
+
+                self.setup.setdefault(concurrency, []).append(setup_time_ms)
+
+                # rejected requests say nothing about service times
+                if inner_time_ms == 0.0:
+                    self.reject_delays_ms.append(outer_time_ms - setup_time_ms)
+                    continue
+
+                overhead_ms = outer_time_ms - setup_time_ms - inner_time_ms
+
+                if e[col["cold_start"]] == "True":
+                    cold.append(overhead_ms)
+                    continue
+
+                # GPUs booted when the request reached the server, which
+                # spreads requests evenly across them
+                booted = max(
+                    1, bisect.bisect_right(boot_times, timestamp + setup_time_ms / 1000)
+                )
+                per_gpu = min(workers_per_gpu, max(1, round(concurrency / booted)))
+
+                self.warm.setdefault(per_gpu, []).append((inner_time_ms, overhead_ms))
+
+        if len(self.warm) == 0:
+            raise ValueError(f"no recorded requests found in {', '.join(files)}")
+
+        self.setup_levels = sorted(self.setup)
+        self.warm_levels = sorted(self.warm)
+
+        # a cold start takes as long as a warm request plus the time it takes
+        # to start the workers, which is what we sample
+        # a cold request is alone on its new GPU
+        warm_overheads = sorted(o for _, o in self.warm[_nearest(self.warm_levels, 1)])
+        median = warm_overheads[len(warm_overheads) // 2]
+        self.cold_delays_ms = [max(0.0, o - median) for o in cold]
+
+        if len(self.cold_delays_ms) == 0:
+            self.cold_delays_ms = [0.0]
+
+        if len(self.reject_delays_ms) == 0:
+            self.reject_delays_ms = [0.0]
+
+    def setup_time(self, concurrency: int) -> float:
+        return self.rng.choice(self.setup[_nearest(self.setup_levels, concurrency)])
+
+    def request(self, per_gpu: int) -> typing.Tuple[float, float]:
+        return self.rng.choice(self.warm[_nearest(self.warm_levels, per_gpu)])
+
+    def cold_delay(self) -> float:
+        return self.rng.choice(self.cold_delays_ms)
+
+    def reject_delay(self) -> float:
+        return self.rng.choice(self.reject_delays_ms)
+
+
+class Simulation:
+    def __init__(
+        self,
+        policy: placement.PlacementPolicy,
+        state: placement.ClusterState,
+        model: LatencyModel,
+        start_time: float,
+    ):
+        self.policy = policy
+        self.state = state
+        self.model = model
+
+        # virtual clock in seconds since the start of the experiment
+        self.now = 0.0
+        self.start_time = start_time
+
+        # (time, sequence number, callback, args), the sequence number keeps
+        # events at the same time in the order they were scheduled
+        self.events: typing.List[typing.Tuple[float, int, typing.Callable, tuple]] = []
+        self.seq = 0
+
+        self.in_flight = 0
+
+        # when the worker behind a slot has finished starting
+        self.ready_at: typing.Dict[typing.Tuple[int, int], float] = {}
+
+        self.logs: typing.List[load.Log] = []
+
+        # (num_workers, gpu, timestamp) in the format of sortserverlogs.py
+        self.serverlogs: typing.List[typing.Tuple[int, int, float]] = []
+
+    def schedule(self, t: float, callback: typing.Callable, *args: typing.Any) -> None:
+        heapq.heappush(self.events, (t, self.seq, callback, args))
+        self.seq += 1
+
+    def run(self) -> None:
+        while len(self.events) > 0:
+            t, _, callback, args = heapq.heappop(self.events)
+            self.now = t
+            callback(*args)
+
+    def request(
+        self,
+        copy: int,
+        on_done: typing.Callable[[], None],
+        concurrency: typing.Optional[typing.Callable[[], int]] = None,
+        scheduled: typing.Optional[float] = None,
+    ) -> None:
+        # one call of run_client: set up the input, send it to the server, and wait
+        self.in_flight += 1
+        in_flight = self.in_flight
+
+        setup_time_ms = self.model.setup_time(in_flight)
+
+        start = self.now
+        self.schedule(
+            self.now + setup_time_ms / 1000,
+            self._arrive,
+            copy,
+            start,
+            in_flight if concurrency is None else concurrency,
+            setup_time_ms,
+            on_done,
+            scheduled,
+        )
+
+    def _arrive(
+        self,
+        copy: int,
+        start: float,
+        concurrency: typing.Union[int, typing.Callable[[], int]],
+        setup_time_ms: float,
+        on_done: typing.Callable[[], None],
+        scheduled: typing.Optional[float],
+    ) -> None:
+        decision = self.policy.place(self.state)
+
+        if decision.action == placement.REJECT:
+            self.serverlogs.append((0, 0, self.start_time + self.now))
+            self.schedule(
+                self.now + self.model.reject_delay() / 1000,
+                self._done,
+                copy,
+                start,
+                concurrency,
+                0.0,
+                setup_time_ms,
+                False,
+                None,
+                on_done,
+                scheduled,
+            )
+            return
+
+        cold_start = decision.action == placement.BOOT
+
+        if cold_start:
+            # all workers on the new GPU start at the same time
+            ready_at = self.now + self.model.cold_delay() / 1000
+            for slot in range(self.state.max_req_per_gpu):
+                self.ready_at[(decision.gpu, slot)] = ready_at
+
+            self.serverlogs.append(
+                (self.state.max_req_per_gpu, decision.gpu, self.start_time + self.now)
+            )
+
+        # requests on a GPU that is still booting wait for its workers
+        wait = max(0.0, self.ready_at[(decision.gpu, decision.slot)] - self.now)
+
+        # the service time depends on how many requests share the GPU
+        inner_time_ms, overhead_ms = self.model.request(
+            sum(self.state.worker_load[decision.gpu])
+        )
+
+        self.schedule(
+            self.now + wait + (inner_time_ms + overhead_ms) / 1000,
+            self._done,
+            copy,
+            start,
+            concurrency,
+            inner_time_ms,
+            setup_time_ms,
+            cold_start,
+            (decision, self.now),
+            on_done,
+            scheduled,
+        )
+
+    def _done(
+        self,
+        copy: int,
+        start: float,
+        concurrency: typing.Union[int, typing.Callable[[], int]],
+        inner_time_ms: float,
+        setup_time_ms: float,
+        cold_start: bool,
+        held: typing.Optional[typing.Tuple[placement.Decision, float]],
+        on_done: typing.Callable[[], None],
+        scheduled: typing.Optional[float],
+    ) -> None:
+        if held is not None:
+            decision, acquired = held
+            self.policy.release(
+                self.state, decision.gpu, decision.slot, self.now - acquired
+            )
+
+        self.in_flight -= 1
+
+        self.logs.append(
+            load.Log(
+                timestamp=self.start_time + start,
+                inner_time_ms=str(round(inner_time_ms, 3)),
+                outer_time_ms=str(round((self.now - start) * 1000, 5)),
+                setup_time_ms=str(round(setup_time_ms, 3)),
+                cold_start=str(cold_start),
+                copy=copy,
+                concurrency=concurrency if isinstance(concurrency, int) else concurrency(),
+                scheduled=None if scheduled is None else self.start_time + scheduled,
+            )
+        )
+
+        on_done()
+
+
+def simulate_ramp(
+    sim: Simulation, min_parallel: int, max_parallel: int, step_size: int, interval: int
+) -> None:
+    # closed-loop clients like in load.py: every client sends requests back to
+    # back and step_size new clients join every interval seconds
+    clients = 0
+
+    # same as load.py, the experiment ends one interval after the last step
+    steps = max(0, -(-(max_parallel - min_parallel) // step_size))
+    end = (steps + 1) * interval
+
+    def _concurrency() -> int:
+        return clients
+
+    def _client(copy: int) -> None:
+        if sim.now >= end:
+            return
+
+        sim.request(copy, lambda: _client(copy), concurrency=_concurrency)
+
+    def _start_clients(first: int, n: int) -> None:
+        nonlocal clients
+        for copy in range(first, first + n):
+            clients += 1
+            _client(copy)
+
+    sim.schedule(0.0, _start_clients, 0, min_parallel)
+
+    concurrency = min_parallel
+    step = 1
+    while concurrency < max_parallel:
+        sim.schedule(step * interval, _start_clients, concurrency, step_size)
+        concurrency += step_size
+        step += 1
+
+    sim.run()
+
+
+def simulate_trace(sim: Simulation, arrivals: typing.List[float], clients: int) -> None:
+    # a pool of clients that send a request for every arrival in the trace
+    # like load.py --trace, arrivals wait if all clients are busy
+    idle = list(range(clients - 1, -1, -1))
+    backlog: typing.List[float] = []
+
+    def _send(copy: int, scheduled: float) -> None:
+        sim.request(copy, lambda: _next(copy), scheduled=scheduled)
+
+    def _next(copy: int) -> None:
+        if len(backlog) > 0:
+            _send(copy, backlog.pop(0))
+            return
+        idle.append(copy)
+
+    def _arrival(scheduled: float) -> None:
+        if len(idle) == 0:
+            backlog.append(scheduled)
+            return
+        _send(idle.pop(), scheduled)
+
+    for offset in arrivals:
+        sim.schedule(offset, _arrival, offset)
+
+    sim.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="KaaS Autoscaling Simulator")
+
+    parser.add_argument(
+        "--recorded",
+        type=str,
+        default="results-autoscaling/*.csv",
+        help="glob of the client results and server logs of recorded runs to sample latencies from.",
+    )
+
+    parser.add_argument(
+        "--num-gpus",
+        type=int,
+        default=1,
+        help="number of GPUs to simulate.",
+    )
+
+    parser.add_argument(
+        "--max-req-per-gpu",
+        type=int,
+        default=1,
+        help="maximum number of requests per GPU.",
+    )
+
+    parser.add_argument(
+        "--policy",
+        type=str,
+        default=placement.KaasPolicy.name,
+        choices=list(placement.POLICIES),
+        help="placement policy for new requests.",
+    )
+
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="seed for sampling latencies.",
+    )
+
+    parser.add_argument(
+        "--experiment-name",
+        type=str,
+        help="name of the experiment.",
+    )
+
+    parser.add_argument(
+        "--task-name",
+        type=str,
+        help="name of the task.",
+    )
+
+    parser.add_argument(
+        "--experiment-description",
+        type=str,
+        help="description of the experiment.",
+    )
+
+    parser.add_argument(
+        "--min-parallel",
+        type=int,
+        help="minimum parallel requests.",
+    )
+
+    parser.add_argument(
+        "--max-parallel",
+        type=int,
+        help="maximum parallel requests.",
+    )
+
+    parser.add_argument(
+        "--step-size",
+        type=int,
+        help="step size.",
+    )
+
+    parser.add_argument(
+        "--interval",
+        type=int,
+        help="interval until next step in seconds.",
+    )
+
+    parser.add_argument(
+        "--trace",
+        type=str,
+        default=None,
+        help="replay the arrivals in a trace instead of ramping up clients, see load.py. --max-parallel sets the number of clients sending requests.",
+    )
+
+    parser.add_argument(
+        "--speedup",
+        type=float,
+        default=1.0,
+        help="time compression factor for the trace.",
+    )
+
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(args.recorded))
+    if len(files) == 0:
+        print(f"No recorded runs found at {args.recorded}")
+        exit(-1)
+
+    rng = random.Random(args.seed)
+    model = LatencyModel(files, rng)
+
+    policy = placement.make_policy(args.policy)
+    if isinstance(policy, placement.PowerOfTwoChoicesPolicy):
+        policy.rng = random.Random(args.seed)
+
+    state = placement.ClusterState(args.num_gpus, args.max_req_per_gpu)
+
+    start_time = datetime.datetime.now(datetime.timezone.utc)
+    sim = Simulation(policy, state, model, start_time.timestamp())
+
+    arrivals: typing.List[float] = []
+
+    t_0 = time.perf_counter()
+
+    if args.trace is not None:
+        if args.max_parallel is None or args.max_parallel < 1:
+            print("Replaying a trace needs --max-parallel (number of clients) of at least 1")
+            exit(-1)
+
+        if args.speedup <= 0:
+            print("--speedup must be positive")
+            exit(-1)
+
+        arrivals = load.load_trace(args.trace, args.speedup)
+
+        if len(arrivals) == 0:
+            print(f"Trace {args.trace} contains no requests")
+            exit(-1)
+
+        simulate_trace(sim, arrivals, args.max_parallel)
+    else:
+        simulate_ramp(
+            sim, args.min_parallel, args.max_parallel, args.step_size, args.interval
+        )
+
+    t_1 = time.perf_counter()
+
+    # same files as load.py and sortserverlogs.py
+    results_dir = f"results-{args.experiment_name}"
+    os.makedirs(results_dir, exist_ok=True)
+
+    results_file = f"{results_dir}/{args.task_name}.csv"
+    description_file = f"{results_dir}/{args.task_name}.md"
+    serverlogs_file = f"{results_dir}/{args.task_name}-serverlogs.csv"
+    replay_file = f"{results_dir}/{args.task_name}-replay.csv"
+
+    # load.py logs requests as they finish
+    sim.logs.sort(key=lambda log: log.timestamp + float(log.outer_time_ms) / 1000)
+
+    with open(results_file, "w") as f:
+        f.write(
+            "timestamp,inner_time_ms,outer_time_ms,setup_time,cold_start,copy,concurrency\n"
+        )
+        for log in sim.logs:
+            f.write(
+                f"{log.timestamp},{log.inner_time_ms},{log.outer_time_ms},{log.setup_time_ms},{log.cold_start},{log.copy},{log.concurrency}\n"
+            )
+
+    with open(serverlogs_file, "w") as f:
+        f.write("num_workers,gpu,timestamp\n")
+        for entry in sorted(sim.serverlogs, key=lambda x: x[2]):
+            f.write(f"{entry[0]},{entry[1]},{entry[2]}\n")
+
+    lags_ms: typing.List[float] = []
+    if args.trace is not None:
+        with open(replay_file, "w") as f:
+            f.write("scheduled,actual,lag_ms,copy\n")
+            for log in sorted(sim.logs, key=lambda log: log.timestamp):
+                lag_ms = round((log.timestamp - log.scheduled) * 1000, 5)
+                lags_ms.append(lag_ms)
+                f.write(f"{log.scheduled},{log.timestamp},{lag_ms},{log.copy}\n")
+
+    simulated = sim.now
+    wall = t_1 - t_0
+
+    with open(description_file, "w") as f:
+        f.write(f"This file describes the fields in the file {results_file}.\n")
+        f.write(f"The measurements were simulated starting on {start_time}.\n")
+        f.write(f"The simulation was run on the machine {os.uname().nodename}.\n")
+
+        f.write("\n")
+
+        f.write("## Parameters\n")
+        f.write(f"Recorded runs: {', '.join(model.files)}\n")
+        f.write(f"GPUs: {args.num_gpus}\n")
+        f.write(f"Maximum requests per GPU: {args.max_req_per_gpu}\n")
+        f.write(f"Policy: {args.policy}\n")
+        f.write(f"Seed: {args.seed}\n")
+        f.write(f"Experiment name: {args.experiment_name}\n")
+        f.write(f"Task name: {args.task_name}\n")
+        f.write(f"Experiment description: {args.experiment_description}\n")
+        f.write(f"Minimum parallel requests: {args.min_parallel}\n")
+        f.write(f"Maximum parallel requests: {args.max_parallel}\n")
+        f.write(f"Step size: {args.step_size}\n")
+        f.write(f"Interval: {args.interval}\n")
+
+        if args.trace is not None:
+            f.write(f"Trace: {args.trace}\n")
+            f.write(f"Speedup: {args.speedup}\n")
+            f.write(f"Arrivals: {len(arrivals)}\n")
+            f.write(f"Replay fidelity: {replay_file}\n")
+
+        f.write("\n")
+
+        f.write(
+            f"The experiment ran for {datetime.timedelta(seconds=simulated)} of simulated time.\n"
+        )
+        f.write(
+            f"The simulation took {wall:.3f}s ({simulated / wall:.0f}x faster than real time).\n"
+        )
+        f.write(f"Policy stats: {policy.stats()}\n")
+
+        if lags_ms:
+            lags_ms.sort()
+            f.write("\n")
+            f.write("## Replay Fidelity\n")
+            f.write(f"Requests sent: {len(lags_ms)} of {len(arrivals)}\n")
+            f.write(f"Mean lag: {sum(lags_ms) / len(lags_ms):.3f}ms\n")
+            f.write(f"Median lag: {lags_ms[len(lags_ms) // 2]:.3f}ms\n")
+            f.write(
+                f"99th percentile lag: {lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]:.3f}ms\n"
+            )
+            f.write(f"Maximum lag: {lags_ms[-1]:.3f}ms\n")
+
+    print(
+        f"Simulated {len(sim.logs)} requests over {simulated:.1f}s in {wall:.3f}s ({simulated / wall:.0f}x real time)"
+    )
+    print(f"@@@ Policy {policy.stats()}")
+    print(f"Results written to {results_file}")